@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from email_main.sqlmanager import format_timestamp, latency_bin_upper
+
+# Default time range of each period when no "since" is given
+DEFAULT_RANGE = {'hour': 24 * 3600, 'day': 30 * 24 * 3600}
+
+
+def bucket_of(period, timestamp):
+    """Rollup bucket ('YYYY-MM-DD HH:00' or 'YYYY-MM-DD') containing a timestamp"""
+    if isinstance(timestamp, str) and timestamp.replace('.', '', 1).isdigit():
+        timestamp = float(timestamp)
+    timestamp = format_timestamp(timestamp).replace('T', ' ')
+    if period == 'day':
+        return timestamp[:10]
+    return timestamp[:13] + ':00' if len(timestamp) >= 13 else timestamp[:10] + ' 00:00'
+
+
+class DashboardAPI:
+    """Read-only queries over the rollup tables
+
+    Every thread gets its own read-only connection. With the database in WAL
+    mode, readers never block the processor that writes the rollups.
+    """
+
+    def __init__(self, db_path="email_analysis.db"):
+        self.db_path = db_path
+        self.local = threading.local()
+
+    def connection(self):
+        """Read-only connection of the current thread"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            uri = f"file:{os.path.abspath(self.db_path)}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, timeout=5)
+            conn.execute('PRAGMA query_only = ON')
+            self.local.conn = conn
+        return conn
+
+    def range(self, period, since=None, until=None):
+        """Validated period and first/last bucket of a query"""
+        if period not in DEFAULT_RANGE:
+            raise ValueError("period must be 'hour' or 'day'")
+        now = time.time()
+        first = bucket_of(period, since) if since else bucket_of(period, now - DEFAULT_RANGE[period])
+        last = bucket_of(period, until) if until else bucket_of(period, now)
+        return first, last
+
+    def verdicts(self, period='hour', since=None, until=None):
+        """Verdict counts per bucket"""
+        first, last = self.range(period, since, until)
+        rows = self.connection().execute('''
+            SELECT bucket, verdict, count FROM rollup_verdicts
+            WHERE period = ? AND bucket BETWEEN ? AND ?
+            ORDER BY bucket
+        ''', (period, first, last)).fetchall()
+        buckets = {}
+        for bucket, verdict, count in rows:
+            buckets.setdefault(bucket, {'bucket': bucket})[verdict] = count
+        return list(buckets.values())
+
+    def latency(self, period='hour', since=None, until=None):
+        """LLM latency percentiles (ms) per bucket, from the latency histogram"""
+        first, last = self.range(period, since, until)
+        rows = self.connection().execute('''
+            SELECT bucket, bin, count FROM rollup_latency
+            WHERE period = ? AND bucket BETWEEN ? AND ?
+            ORDER BY bucket, bin
+        ''', (period, first, last)).fetchall()
+        histograms = {}
+        for bucket, bin_index, count in rows:
+            histograms.setdefault(bucket, []).append((bin_index, count))
+
+        result = []
+        for bucket, histogram in histograms.items():
+            total = sum(count for _, count in histogram)
+            entry = {'bucket': bucket, 'count': total}
+            for name, pct in (('p50', 50), ('p95', 95), ('p99', 99)):
+                target = total * pct / 100
+                seen = 0
+                for bin_index, count in histogram:
+                    seen += count
+                    if seen >= target:
+                        entry[name] = round(latency_bin_upper(bin_index), 1)
+                        break
+            result.append(entry)
+        return result
+
+    def top_domains(self, period='day', since=None, until=None, kind='domain', limit=10):
+        """Most frequent link domains (kind='domain') or sender domains (kind='sender_domain')"""
+        first, last = self.range(period, since, until)
+        rows = self.connection().execute('''
+            SELECT domain, SUM(count) AS total FROM rollup_domains
+            WHERE period = ? AND bucket BETWEEN ? AND ? AND kind = ?
+            GROUP BY domain
+            ORDER BY total DESC
+            LIMIT ?
+        ''', (period, first, last, kind, int(limit))).fetchall()
+        return [{'domain': domain, 'count': total} for domain, total in rows]
+
+    def jobs(self):
+        """Number of jobs per state"""
+        return dict(self.connection().execute('SELECT state, COUNT(*) FROM email_jobs GROUP BY state').fetchall())
+
+
+class DashboardHandler(BaseHTTPRequestHandler):
+    """GET-only JSON endpoints"""
+
+    api = None
+
+    routes = {
+        '/api/verdicts': lambda api, q: api.verdicts(q.get('period', 'hour'), q.get('since'), q.get('until')),
+        '/api/latency': lambda api, q: api.latency(q.get('period', 'hour'), q.get('since'), q.get('until')),
+        '/api/top-domains': lambda api, q: api.top_domains(
+            q.get('period', 'day'), q.get('since'), q.get('until'), q.get('kind', 'domain'), q.get('limit', 10)
+        ),
+        '/api/jobs': lambda api, q: api.jobs()
+    }
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        route = self.routes.get(url.path.rstrip('/'))
+        if route is None:
+            self.send_json(404, {'error': 'Not found', 'endpoints': sorted(self.routes)})
+            return
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            self.send_json(200, route(self.api, query))
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+        except sqlite3.Error as e:
+            logging.error(f"Dashboard query error: {e}")
+            self.send_json(503, {'error': 'Database unavailable'})
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"Dashboard {self.address_string()} - {format % args}")
+
+
+def serve(db_path="email_analysis.db", host=None, port=None):
+    """Serve the dashboard API until interrupted"""
+    host = host or os.getenv("DASHBOARD_HOST", "127.0.0.1")
+    port = int(port or os.getenv("DASHBOARD_PORT", 8080))
+    DashboardHandler.api = DashboardAPI(db_path)
+    server = ThreadingHTTPServer((host, port), DashboardHandler)
+    logging.info(f"Dashboard API listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.debug("Dashboard API stopped")
+    finally:
+        server.server_close()
@@ -0,0 +1,138 @@
+import gzip
+import logging
+import os
+import socket
+import threading
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class EmailArchive:
+    """Append-only, date-sharded, compressed segment files for processed emails
+
+    Each message is compressed on its own and appended to the current segment
+    (ROOT/YYYY/MM/DD/<host>-<pid>-<n>.seg.<gz|zst>). Its offset and length are
+    stored in the email_archive table, so a single message can be read back
+    with one seek. Every process writes its own segments, so several workers
+    can archive at the same time.
+    """
+
+    EXTENSIONS = {'gzip': 'gz', 'zstd': 'zst'}
+    # Default and valid compression levels of each format
+    LEVELS = {'gzip': (6, 0, 9), 'zstd': (3, 1, 22)}
+
+    def __init__(self, sql_manager, root=None, compression=None, segment_max_bytes=None):
+        self.sql_manager = sql_manager
+        self.root = root or os.getenv("ARCHIVE_FOLDER", "eml-archive")
+        self.segment_max_bytes = int(segment_max_bytes or float(os.getenv("ARCHIVE_SEGMENT_MAX_MB", 64)) * 1024 * 1024)
+
+        # gzip by default, zstd is opt-in and needs the optional zstandard package
+        compression = (compression or os.getenv("ARCHIVE_COMPRESSION", "gzip")).lower()
+        if compression == 'zstd' and zstandard is None:
+            logging.warning("ARCHIVE_COMPRESSION is zstd but zstandard is not installed, archiving with gzip")
+            compression = 'gzip'
+        if compression not in self.EXTENSIONS:
+            raise ValueError(f"Unsupported archive compression: {compression}")
+        self.compression = compression
+
+        # Read once the format is known, a zstd level may not suit the gzip fallback
+        default, lowest, highest = self.LEVELS[compression]
+        level = int(os.getenv("ARCHIVE_COMPRESSION_LEVEL", default))
+        self.level = min(max(level, lowest), highest)
+        if self.level != level:
+            logging.warning(f"ARCHIVE_COMPRESSION_LEVEL {level} out of range for {compression}, using {self.level}")
+
+        self.lock = threading.Lock()
+        self.segment = None
+        self.segment_file = None
+        self.segment_day = None
+        self.segment_size = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    def compress(self, raw):
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor(level=self.level).compress(raw)
+        return gzip.compress(raw, compresslevel=self.level)
+
+    @staticmethod
+    def decompress(data, compression):
+        if compression == 'zstd':
+            if zstandard is None:
+                raise RuntimeError("zstandard is required to read zstd archive segments")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+
+    def _open_segment(self, day):
+        """Start a new segment file for the given day"""
+        self.close()
+        folder = os.path.join(self.root, day.strftime("%Y"), day.strftime("%m"), day.strftime("%d"))
+        os.makedirs(folder, exist_ok=True)
+        prefix = f"{socket.gethostname()}-{os.getpid()}-"
+        extension = self.EXTENSIONS[self.compression]
+        taken = [f for f in os.listdir(folder) if f.startswith(prefix)]
+        name = f"{prefix}{len(taken):04d}.seg.{extension}"
+
+        self.segment = os.path.relpath(os.path.join(folder, name), self.root)
+        self.segment_file = open(os.path.join(folder, name), 'ab')
+        self.segment_day = day.date()
+        self.segment_size = self.segment_file.tell()
+        logging.debug(f"Archive segment opened: {self.segment}")
+
+    def put(self, key, raw, when=None):
+        """Append a message to the archive and index it, returns the segment path"""
+        when = when or datetime.now()
+        data = self.compress(raw)
+        with self.lock:
+            if (self.segment_file is None or self.segment_day != when.date()
+                    or 0 < self.segment_size and self.segment_size + len(data) > self.segment_max_bytes):
+                self._open_segment(when)
+            offset = self.segment_size
+            self.segment_file.write(data)
+            self.segment_file.flush()
+            # The message must be on disk before its source file is removed
+            os.fsync(self.segment_file.fileno())
+            self.segment_size += len(data)
+            segment = self.segment
+
+        self.sql_manager.add_archive_entry(key, segment, offset, len(data), len(raw), self.compression)
+        return segment
+
+    def get(self, key=None, analysis_id=None):
+        """Read one archived message back by filename or analysis id, None if it is not archived"""
+        entry = self.sql_manager.get_archive_entry(key, analysis_id=analysis_id)
+        if entry is None:
+            return None
+        segment, offset, length, compression = entry
+        with open(os.path.join(self.root, segment), 'rb') as f:
+            f.seek(offset)
+            data = f.read(length)
+        return self.decompress(data, compression)
+
+    def import_folder(self, folder):
+        """Move every .eml file of a folder into the archive, sharded by modification date"""
+        imported = 0
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.endswith('.eml'):
+                    continue
+                try:
+                    with open(entry.path, 'rb') as f:
+                        raw = f.read()
+                    self.put(entry.name, raw, when=datetime.fromtimestamp(entry.stat().st_mtime))
+                    os.remove(entry.path)
+                    imported += 1
+                except Exception as e:
+                    logging.error(f"Error archiving {entry.name}: {e}")
+        logging.info(f"Archived {imported} emails from {folder}")
+        return imported
+
+    def close(self):
+        """Close the current segment"""
+        if self.segment_file is not None:
+            self.segment_file.close()
+            self.segment_file = None
+            self.segment = None
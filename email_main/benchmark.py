@@ -0,0 +1,213 @@
+import contextlib
+import io
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import email_main.processor.dkim as DKIMProcessor
+import email_main.processor.llm as LLM
+from email_main.email_processor import EmailProcessor
+from email_main.sqlmanager import SQLManager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class FakeLLM:
+    """Stand-in for the Ollama backend with a log-normal latency distribution"""
+
+    def __init__(self, latency_ms=500.0, sigma=0.25, phishing_ratio=0.1, seed=42):
+        self.latency_ms = latency_ms
+        self.sigma = sigma
+        self.phishing_ratio = phishing_ratio
+        self.random = random.Random(seed)
+
+    def check_phishing(self, content, indicators, ollama_api_url, model, auth_token, stream, language):
+        # Build the real prompt so its CPU cost and size are part of the measurement
+        prompt = LLM.build_prompt(content, indicators, language or "EN")
+        payload_size_kb = len(json.dumps({"model": model, "prompt": prompt}).encode('utf-8')) / 1024
+
+        start_time = time.time()
+        if self.latency_ms > 0:
+            latency = self.random.lognormvariate(0, self.sigma) * self.latency_ms / 1000
+            time.sleep(latency)
+
+        flagged = bool(indicators.get('google_safe_browsing'))
+        verdict = 'phishing' if flagged or self.random.random() < self.phishing_ratio else 'legitimate'
+        response = {
+            'verdict': verdict,
+            'confidence': self.random.choice(['low', 'medium', 'high']),
+            'reasons': ['Replay verdict', 'Generated by the fake LLM', 'No model was contacted']
+        }
+        return response, time.time() - start_time, payload_size_kb
+
+
+class FakeSafeBrowsing:
+    """Google Safe Browsing stub that never leaves the machine"""
+
+    def google_safe_browsing(self, url, api_key=None):
+        return {"matches": [], "error": None}
+
+
+class FakeDKIM:
+    """Runs the real DKIM verification with a DNS resolver that never finds a key"""
+
+    @staticmethod
+    def _dns_stub(name, timeout=5):
+        return None
+
+    def dkim_passes_from_bytes(self, eml_bytes, enable=False, dnsfunc=None):
+        return DKIMProcessor.dkim_passes_from_bytes(eml_bytes, True, dnsfunc=self._dns_stub)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(values):
+    """Latency summary (milliseconds) of a list of durations in seconds"""
+    if not values:
+        return {"count": 0, "mean": None, "p50": None, "p95": None, "p99": None}
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) * 1000,
+        "p50": percentile(values, 50) * 1000,
+        "p95": percentile(values, 95) * 1000,
+        "p99": percentile(values, 99) * 1000
+    }
+
+
+def peak_rss_kb():
+    """Peak resident set size of this process in KB"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports kilobytes
+    return peak / 1024 if sys.platform == 'darwin' else peak
+
+
+@contextlib.contextmanager
+def replay_environment(workdir):
+    """Temporarily point the processor configuration at an isolated work directory"""
+    overrides = {
+        "INBOX_EML_FOLDER": os.path.join(workdir, "inbox"),
+        "INBOX_PROCESSED_FOLDER": os.path.join(workdir, "processed"),
+        "WAIT_INTERVAL_LLM": "0",
+        "SEND_EMAIL_ALERTS": "false",
+        "DKIM_ENABLED": "true",
+        "GOOGLE_SAFE_BROWSING_ENABLED": "true",
+        "GOOGLE_SAFE_BROWSING_API_KEY": "replay",
+        "OLLAMA_MODEL": "replay-fake-llm",
+        "OLLAMA_RESPONSE_LANGUAGE": "EN"
+    }
+    previous = {key: os.environ.get(key) for key in overrides}
+    os.environ.update(overrides)
+    try:
+        yield overrides
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def run_replay(corpus_folder, output_file="replay_results.json", latency_ms=500.0, sigma=0.25,
+               phishing_ratio=0.1, seed=42, repeat=1):
+    """Replay a folder of .eml files through EmailProcessor and write the results as JSON"""
+    corpus = sorted(f for f in os.listdir(corpus_folder) if f.endswith('.eml'))
+    if not corpus:
+        raise ValueError(f"No .eml files found in {corpus_folder}")
+
+    fake_llm = FakeLLM(latency_ms=latency_ms, sigma=sigma, phishing_ratio=phishing_ratio, seed=seed)
+
+    with tempfile.TemporaryDirectory(prefix="replay_") as workdir, replay_environment(workdir) as env:
+        os.makedirs(env["INBOX_EML_FOLDER"], exist_ok=True)
+        processor = EmailProcessor(
+            sql_manager=SQLManager(db_path=os.path.join(workdir, "replay.db")),
+            llm=fake_llm,
+            url_processor=FakeSafeBrowsing(),
+            dkim_processor=FakeDKIM()
+        )
+
+        # Stage the corpus before measuring so copying is not part of the results
+        filenames = []
+        for run in range(repeat):
+            for name in corpus:
+                staged = f"r{run:03d}_{name}"
+                shutil.copyfile(os.path.join(corpus_folder, name), os.path.join(env["INBOX_EML_FOLDER"], staged))
+                filenames.append(staged)
+
+        stages = {}
+        totals = []
+        processed = 0
+        failed = 0
+        logging.info(f"Replaying {len(filenames)} emails from {corpus_folder}")
+
+        processor.enqueue_folder()
+
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        while True:
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                job, result = processor.process_next_job()
+            if not job:
+                break
+            totals.append(time.perf_counter() - started)
+            if result:
+                processed += 1
+            else:
+                failed += 1
+            for stage, duration in processor.stage_timings.items():
+                stages.setdefault(stage, []).append(duration)
+        wall_time = time.perf_counter() - wall_start
+        cpu_time = time.process_time() - cpu_start
+
+        processor.stop()
+
+    results = {
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": os.path.abspath(corpus_folder),
+        "emails": len(filenames),
+        "processed": processed,
+        "failed": failed,
+        "wall_time_s": wall_time,
+        "cpu_time_s": cpu_time,
+        # Only successfully processed emails count, a broken build must not look faster
+        "emails_per_second": processed / wall_time if wall_time > 0 else None,
+        "peak_rss_kb": peak_rss_kb(),
+        "llm": {
+            "latency_ms": latency_ms,
+            "sigma": sigma,
+            "phishing_ratio": phishing_ratio,
+            "seed": seed
+        },
+        "total_ms": summarize(totals),
+        "stages_ms": {stage: summarize(values) for stage, values in stages.items()}
+    }
+
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=4)
+    logging.info(f"Replay finished: {processed} processed, {failed} failed, "
+                 f"{results['emails_per_second'] or 0:.2f} emails/s, results saved to {output_file}")
+    if failed:
+        logging.warning(f"{failed} of {len(filenames)} emails failed, the throughput is not comparable")
+    return results
@@ -1,4 +1,3 @@
-import schedule
 import time
 import os
 import logging
@@ -7,10 +6,15 @@ from email import message_from_bytes
 import imaplib
 from datetime import datetime
 import threading
+from email_main.sqlmanager import SQLManager
+from email_main.flow_control import FlowController, sender_priority
 
 class EmailMonitor:
-    def __init__(self):
+    def __init__(self, sql_manager=None, flow=None):
         self.imap_conn = None
+        self.sql_manager = sql_manager or SQLManager()
+        # Shared with the processor to pause fetching when the queue is too deep
+        self.flow = flow or FlowController(self.sql_manager)
         self.max_threads = int(os.getenv("MAX_THREADS", 2))
         self.interval = int(os.getenv("INBOX_CHECK_INTERVAL"))
         self.executor = ThreadPoolExecutor(max_workers=self.max_threads)
@@ -99,6 +103,15 @@ class EmailMonitor:
             
             with open(filepath, 'wb') as f:
                 f.write(raw_email)
+
+            # Hand the email over to the processor through the job queue
+            queued = self.sql_manager.enqueue_job(filename, priority=sender_priority(email_message.get('From')))
+            if queued is None:
+                # Keep the message unread so it is fetched again on the next check
+                os.remove(filepath)
+                return None
+            if not queued:
+                logging.warning(f"Email {filename} was already queued")
                 
             logging.debug(f"Email saved as {filename}")
             return filepath
@@ -110,7 +123,8 @@ class EmailMonitor:
     def process_email(self, email_id):
         """Process individual email"""
         try:
-            status, msg_data = self.imap_conn.fetch(email_id, '(RFC822)')
+            # BODY.PEEK leaves the Seen flag alone until the email is saved
+            status, msg_data = self.imap_conn.fetch(email_id, '(BODY.PEEK[])')
             if status != 'OK':
                 logging.error(f"Error fetching email {email_id}")
                 return False
@@ -158,7 +172,16 @@ class EmailMonitor:
                     return
             
             unread_emails = self.get_unread_emails()
-            
+
+            # Fetch only what the processors can keep up with, the rest stays unread
+            batch_size = self.flow.fetch_batch_size(self.interval)
+            if unread_emails and batch_size == 0:
+                logging.debug(f"Queue above the high watermark, leaving {len(unread_emails)} unread emails on the server")
+                return
+            if len(unread_emails) > batch_size:
+                logging.debug(f"Fetching {batch_size} of {len(unread_emails)} unread emails (backpressure)")
+                unread_emails = unread_emails[:batch_size]
+
             if unread_emails:
                 logging.debug(f"Processing {len(unread_emails)} unread emails.")
                 
@@ -171,6 +194,7 @@ class EmailMonitor:
                     success = self.process_email(email_id)
                     if success:
                         logging.debug(f"Successfully processed email {email_id}")
+                        self.flow.notify()
                     else:
                         logging.error(f"Failed to process email {email_id}")
             else:
@@ -191,6 +215,7 @@ class EmailMonitor:
                 return
         
         # Schedule the email checking job
+        import schedule
         schedule.every(self.interval).seconds.do(self.check_emails)
         
         logging.debug(f"Monitoring scheduled every {self.interval} seconds.")
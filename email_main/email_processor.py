@@ -1,3 +1,4 @@
+import importlib.util
 import json
 import time
 import os
@@ -8,25 +9,92 @@ import re
 import email_main.processor.llm as LLM
 import email_main.send_alerts as EmailSender
 from email_main.sqlmanager import SQLManager
+from email_main.reputation import ReputationStore
+from email_main.archive import EmailArchive
+from email_main.flow_control import FlowController
 import email_main.processor.url as URLProcessor
 import email_main.processor.dkim as DKIMProcessor
-from bs4 import BeautifulSoup
 from urllib.parse import urlparse
+import socket
 import threading
 
 class EmailProcessor:
-    def __init__(self):
+    def __init__(self, sql_manager=None, llm=LLM, url_processor=URLProcessor, dkim_processor=DKIMProcessor, alert_sender=None, reputation=None, archive=None, flow=None):
         self.emails_folder = os.getenv("INBOX_EML_FOLDER")
         self.processed_folder = os.getenv("INBOX_PROCESSED_FOLDER")
-        self.sql_manager = SQLManager()
+        self.sql_manager = sql_manager or SQLManager()
         self.interval = int(os.getenv("WAIT_INTERVAL_LLM"))
         self.running = True
         self.stop_event = threading.Event()
-        self._processing = False 
+        self._local = threading.local()
+        self._export_lock = threading.Lock()
+
+        # Adaptive concurrency and idle wait, shared with the monitor that feeds the queue
+        self.flow = flow or FlowController(self.sql_manager)
+
+        # Analysis backends (replaceable, e.g. by the offline replay benchmark)
+        self.llm = llm
+        self.url_processor = url_processor
+        self.dkim_processor = dkim_processor
+
+        # dkimpy is only imported by the first verification, but a missing one must stop startup, not every job
+        self.dkim_enabled = os.getenv("DKIM_ENABLED", "false").lower() == "true"
+        if self.dkim_enabled and importlib.util.find_spec("dkim") is None:
+            raise RuntimeError("DKIM_ENABLED is true but dkimpy is not installed (pip install dkimpy)")
+
+        # Sender/domain reputation from previous verdicts
+        self.reputation = reputation
+        if self.reputation is None and os.getenv("REPUTATION_ENABLED", "true").lower() == "true":
+            self.reputation = ReputationStore(self.sql_manager)
+
+        # Processed emails go to compressed archive segments instead of one file each
+        self.archive = archive
+        if self.archive is None and os.getenv("ARCHIVE_ENABLED", "false").lower() == "true":
+            self.archive = EmailArchive(self.sql_manager)
+
+        # Alerts go through the outbound queue when a sender thread is running
+        self.alert_sender = alert_sender
+        if os.getenv("SEND_EMAIL_ALERTS", "false").lower() == "true":
+            EmailSender.preload_templates(os.getenv("ALERT_TEMPLATE"))
+
+
+        # Job queue settings (leases let other workers take over after a crash)
+        self.lease_seconds = int(os.getenv("JOB_LEASE_SECONDS", 300))
+        self.max_attempts = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+        self.retry_backoff = int(os.getenv("JOB_RETRY_BACKOFF", 30))
+
+        # Alerts still unsent after this many seconds are queued again (crash, shutdown, SMTP down)
+        self.alert_resend_after = int(os.getenv("ALERT_RESEND_AFTER", 600))
+        self._alerts_checked_at = None
+        self._alerts_lock = threading.Lock()
+
+        # Finished jobs are deleted after this many days (0 keeps them), checked at most once an hour
+        self.job_retention_days = float(os.getenv("JOB_RETENTION_DAYS", 30))
+        self._jobs_pruned_at = None
         
         # Create processed folder if it does not exist
         os.makedirs(self.processed_folder, exist_ok=True)
 
+        # Queue any .eml files that were saved before the job table existed
+        self.enqueue_folder()
+
+    # Per-stage durations (seconds) and error of the last email processed by the current thread
+    @property
+    def stage_timings(self):
+        return getattr(self._local, 'stage_timings', {})
+
+    @stage_timings.setter
+    def stage_timings(self, value):
+        self._local.stage_timings = value
+
+    @property
+    def last_error(self):
+        return getattr(self._local, 'last_error', None)
+
+    @last_error.setter
+    def last_error(self, value):
+        self._local.last_error = value
+
     def extract_indicators(self, text):
         """Extract emails, URLs and domains from text"""
         emails = re.findall(r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+", text)
@@ -74,6 +142,7 @@ class EmailProcessor:
                 body = payload.decode('utf-8', errors='ignore') if payload else ""
 
             if not plain_body_found and html_body:
+                from bs4 import BeautifulSoup  # only needed for HTML-only emails
                 soup = BeautifulSoup(html_body, 'html.parser')
                 body = soup.get_text()
 
@@ -90,71 +159,139 @@ class EmailProcessor:
             logging.error(f"Error extracting email components: {e}")
             return None
 
-    def process_single_email(self, filename):
+    def _record_stage(self, stage, started):
+        """Store the elapsed time of a processing stage and return a new start time"""
+        now = time.perf_counter()
+        self.stage_timings[stage] = now - started
+        return now
+
+    def worker_id(self):
+        """Identify this worker (host, process and thread) as the job lease owner"""
+        return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+    def enqueue_folder(self):
+        """Add every .eml file in the emails_folder to the job queue"""
+        try:
+            os.makedirs(self.emails_folder, exist_ok=True)
+            queued = sum(
+                1 for f in os.listdir(self.emails_folder)
+                if f.endswith('.eml') and self.sql_manager.enqueue_job(f)
+            )
+            if queued:
+                logging.debug(f"Queued {queued} emails found in {self.emails_folder}")
+            return queued
+        except Exception as e:
+            logging.error(f"Error queuing emails from {self.emails_folder}: {e}")
+            return 0
+
+    def read_email(self, filename):
+        """Read a raw email from the emails_folder, the processed folder or the archive"""
+        for folder in (self.emails_folder, self.processed_folder):
+            try:
+                with open(os.path.join(folder, filename), 'rb') as f:
+                    return f.read()
+            except FileNotFoundError:
+                continue
+        if self.archive is not None:
+            try:
+                return self.archive.get(filename)
+            except Exception as e:
+                logging.error(f"Error reading {filename} from the archive: {e}")
+        return None
+
+    def archive_email(self, filename, raw_email):
+        """Append a processed email to the archive, then remove its file"""
+        try:
+            segment = self.archive.put(filename, raw_email)
+        except Exception as e:
+            # Keep the file in the processed folder, "main.py archive import" can archive it later
+            logging.error(f"Error archiving {filename}: {e}")
+            try:
+                os.replace(os.path.join(self.emails_folder, filename), os.path.join(self.processed_folder, filename))
+            except FileNotFoundError:
+                pass
+            return False
+        for folder in (self.emails_folder, self.processed_folder):
+            try:
+                os.remove(os.path.join(folder, filename))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logging.error(f"Error removing archived file {filename}: {e}")
+        logging.debug(f"File archived to: {segment}")
+        return True
+
+    def process_single_email(self, filename, job=None):
         """Process a single email file"""
+        self.stage_timings = {}
+        self.last_error = None
+        started = time.perf_counter()
         filepath = os.path.join(self.emails_folder, filename)
         processed_filepath = os.path.join(self.processed_folder, filename)
         
-        # Skip if already in processed folder
-        if os.path.exists(processed_filepath):
-            logging.debug(f"Skipping {filename}: already in processed folder")
-            return None
-        
         try:
             logging.debug(f"Analyzing: {filename}")
-            if not os.path.exists(filepath):
-                logging.warning(f"File {filepath} does not exist")
-                return None
-            
-            with open(filepath, 'rb') as f:
-                raw_email = f.read()
-
-            # Move file immediately after reading to prevent reprocessing
-            try:
-                os.rename(filepath, processed_filepath)
-                logging.debug(f"File moved to: {processed_filepath}")
-            except Exception as e:
-                logging.error(f"Error moving file {filename}: {e}")
+            raw_email = self.read_email(filename)
+            if raw_email is None:
+                self.last_error = f"File {filename} does not exist"
+                logging.warning(self.last_error)
                 return None
+            started = self._record_stage('read', started)
 
             email_message = BytesParser(policy=policy.default).parsebytes(raw_email)
             components = self.extract_email_components(raw_email)
-            dkim_ok = DKIMProcessor.dkim_passes_from_bytes(raw_email, os.getenv("DKIM_ENABLED"))
+            started = self._record_stage('parse', started)
+            dkim_ok = self.dkim_processor.dkim_passes_from_bytes(raw_email, self.dkim_enabled)
+            started = self._record_stage('dkim', started)
             
             if not components:
-                logging.warning(f"Could not extract components from {filename}")
+                self.last_error = f"Could not extract components from {filename}"
+                logging.warning(self.last_error)
                 return None
 
             indicators = self.extract_indicators(components['body'])
             indicators['dkim'] = dkim_ok
+            started = self._record_stage('indicators', started)
             
-            if os.getenv("GOOGLE_SAFE_BROWSING_ENABLED").lower() == "true":
-                for url in indicators['urls']:
-                    try:
-                        result = URLProcessor.google_safe_browsing(
-                            url=url,
-                            api_key=os.getenv("GOOGLE_SAFE_BROWSING_API_KEY")
-                        )
-                        if result["matches"]:
-                            indicators['google_safe_browsing'][url] = result["matches"]
-                    except Exception as e:
-                        logging.error(f"Error checking URL {url} with Google Safe Browsing: {e}")
+            self.check_safe_browsing(indicators)
+            started = self._record_stage('safe_browsing', started)
                         
-            body_without_urls = re.sub(r'https?://[^\s]+', '', components['body'])
+            # Known-bad or long-trusted senders skip the LLM
+            shortcut = None
+            model = os.getenv("OLLAMA_MODEL")
+            if self.reputation is not None:
+                reputation = self.reputation.lookup(email_message['From'])
+                indicators['reputation'] = self.reputation.describe(reputation)
+                shortcut = self.reputation.short_circuit(reputation, indicators)
+            started = self._record_stage('reputation', started)
 
-            result, duration, size = LLM.check_phishing(
-                content={
-                    'from': email_message['From'],
-                    'subject': email_message['Subject'],
-                    'body': body_without_urls
-                },
-                indicators=indicators,
-                ollama_api_url=os.getenv("OLLAMA_URL"),
-                model=os.getenv("OLLAMA_MODEL"),
-                auth_token=os.getenv("OLLAMA_AUTH_TOKEN"),
-                stream=os.getenv("OLLAMA_STREAM", "false").lower() == "true",
-                language=os.getenv("OLLAMA_RESPONSE_LANGUAGE")
-            )
+            if shortcut:
+                logging.debug(f"Reputation verdict for {filename}: {shortcut['verdict']}")
+                result, duration, size, model = shortcut, 0.0, 0.0, 'reputation'
+            else:
+                body_without_urls = re.sub(r'https?://[^\s]+', '', components['body'])
+
+                result, duration, size = self.llm.check_phishing(
+                    content={
+                        'from': email_message['From'],
+                        'subject': email_message['Subject'],
+                        'body': body_without_urls
+                    },
+                    indicators=indicators,
+                    ollama_api_url=os.getenv("OLLAMA_URL"),
+                    model=model,
+                    auth_token=os.getenv("OLLAMA_AUTH_TOKEN"),
+                    stream=os.getenv("OLLAMA_STREAM", "false").lower() == "true",
+                    language=os.getenv("OLLAMA_RESPONSE_LANGUAGE")
+                )
+                # Only timed when the LLM was actually called
+                started = self._record_stage('llm', started)
+
+            # Leave the job queued for a retry instead of storing an empty verdict
+            if duration is None:
+                self.last_error = result
+                logging.error(f"LLM analysis failed for {filename}: {result}")
+                return None
 
             analysis_data = {
                 'filename': filename,
@@ -162,16 +299,19 @@ class EmailProcessor:
                 'from': email_message['From'],
                 'to': email_message['To'],
                 'date': email_message['Date'],
+                'body': components['body'],
                 'footer': components['footer'],
                 'attachments': components['attachments'],
                 'indicators': indicators,
                 'size': size,
                 'llm': {
-                    'model': os.getenv("OLLAMA_MODEL"),
+                    'model': model,
                     'response': result,
                     'duration': duration
-                }
+                },
+                'reputation_hit': bool(shortcut)
             }
+            analysis_data['recheck'] = not shortcut and self.needs_recheck(result, indicators)
             
             print(f"\n{'='*50}")
             print(f"ANALYSIS COMPLETE: {filename}")
@@ -179,107 +319,243 @@ class EmailProcessor:
             print(json.dumps(analysis_data['llm'], indent=4, ensure_ascii=False))
             print(f"{'='*50}\n")
 
-            self.sql_manager.save_analysis(analysis_data)
-
-            if os.getenv("SEND_EMAIL_ALERTS").lower() == "true":
-                if analysis_data['llm']['response'].get('verdict') == 'phishing':
-                    try:
-                        EmailSender.send_email(
-                            subject=f"Phishing Alert: {analysis_data['subject']}",
-                            html_sender=EmailSender.generate_phishing_warning(
-                                json_data=analysis_data,
-                                template_name=os.path.join(os.getenv("ALERT_TEMPLATE"))
-                            )
-                        )
-                    except Exception as e:
-                        logging.error(f"Error sending alert for {filename}: {e}")
+            # Phishing jobs stay in alert_pending until the alert is sent
+            alerting = (isinstance(result, dict) and result.get('verdict') == 'phishing'
+                        and os.getenv("SEND_EMAIL_ALERTS", "false").lower() == "true")
+            analysis_id = self.sql_manager.save_analysis(
+                analysis_data, job=job, job_state='alert_pending' if alerting else 'analyzed'
+            )
+            if analysis_id is None:
+                self.last_error = f"Could not save analysis of {filename}"
+                return None
+            analysis_data['id'] = analysis_id
+            if self.reputation is not None and not shortcut:
+                self.reputation.record(email_message['From'], result)
+
+            # Move the file only once its verdict is stored
+            if self.archive is not None:
+                self.archive_email(filename, raw_email)
+            else:
+                try:
+                    os.replace(filepath, processed_filepath)
+                    logging.debug(f"File moved to: {processed_filepath}")
+                except FileNotFoundError:
+                    pass  # Already moved by an earlier attempt
+                except Exception as e:
+                    logging.error(f"Error moving file {filename}: {e}")
+            started = self._record_stage('database', started)
+
+            if isinstance(result, dict) and result.get('verdict') == 'phishing':
+                self.send_alert(analysis_data, **self.alert_options(job))
+            self._record_stage('alert', started)
 
             return analysis_data
 
         except Exception as e:
+            self.last_error = str(e)
             logging.error(f"Error processing {filename}: {e}")
             return None
 
-    def get_oldest_email(self):
-        """Get the oldest .eml file in the emails_folder based on modification time"""
+    def check_safe_browsing(self, indicators):
+        """Add Google Safe Browsing matches for the extracted URLs to the indicators"""
+        if os.getenv("GOOGLE_SAFE_BROWSING_ENABLED").lower() != "true":
+            return
+        for url in indicators['urls']:
+            try:
+                result = self.url_processor.google_safe_browsing(
+                    url=url,
+                    api_key=os.getenv("GOOGLE_SAFE_BROWSING_API_KEY")
+                )
+                if result["matches"]:
+                    indicators['google_safe_browsing'][url] = result["matches"]
+            except Exception as e:
+                logging.error(f"Error checking URL {url} with Google Safe Browsing: {e}")
+
+    def needs_recheck(self, response, indicators):
+        """Decide if a verdict should get a second opinion from the recheck model"""
+        if os.getenv("RECHECK_ENABLED", "false").lower() != "true":
+            return False
+        if not isinstance(response, dict) or response.get('verdict') not in ('phishing', 'legitimate'):
+            return True
+        levels = [c.strip() for c in os.getenv("RECHECK_CONFIDENCE", "low,medium").lower().split(',')]
+        if str(response.get('confidence', '')).lower() in levels:
+            return True
+        # Disputed: flagged by Safe Browsing but judged legitimate by the LLM
+        return response.get('verdict') == 'legitimate' and bool(indicators.get('google_safe_browsing'))
+
+    def alert_options(self, job):
+        """send_alert arguments for a job: its id as the queue key, and callbacks that record the outcome"""
+        if job is None:
+            return {}
+        return {
+            'key': job['id'],
+            'on_sent': lambda: self.sql_manager.finish_alert(job, 'alerted'),
+            'on_rejected': lambda: self.sql_manager.finish_alert(job, 'alert_failed')
+        }
+
+    def resend_alerts(self, force=False):
+        """Queue again the alerts left in alert_pending, at most every ALERT_RESEND_AFTER seconds"""
+        if os.getenv("SEND_EMAIL_ALERTS", "false").lower() != "true":
+            return 0
+        with self._alerts_lock:
+            now = time.monotonic()
+            if not force and self._alerts_checked_at is not None and now - self._alerts_checked_at < self.alert_resend_after:
+                return 0
+            self._alerts_checked_at = now
         try:
-            if not os.path.exists(self.emails_folder):
-                logging.error(f"Folder {self.emails_folder} does not exist.")
-                return None
-            
-            eml_files = [f for f in os.listdir(self.emails_folder) if f.endswith('.eml')]
-            if not eml_files:
-                logging.debug("No emails found to process")
-                return None
-            
-            # Get the oldest file based on modification time
-            oldest_file = min(
-                eml_files,
-                key=lambda f: os.path.getmtime(os.path.join(self.emails_folder, f))
+            pending = self.sql_manager.claim_unsent_alerts(self.worker_id(), self.alert_resend_after)
+        except Exception as e:
+            logging.error(f"Error reading unsent alerts: {e}")
+            return 0
+        # Alerts still waiting in the sender queue (e.g. while SMTP is down) are not queued twice
+        queued = sum(1 for job, analysis_data in pending if self.send_alert(analysis_data, **self.alert_options(job)))
+        if queued:
+            logging.info(f"Queued {queued} unsent alerts again")
+        return queued
+
+    def prune_jobs(self):
+        """Delete jobs finished more than JOB_RETENTION_DAYS ago, at most once an hour"""
+        if self.job_retention_days <= 0:
+            return 0
+        with self._alerts_lock:
+            now = time.monotonic()
+            if self._jobs_pruned_at is not None and now - self._jobs_pruned_at < 3600:
+                return 0
+            self._jobs_pruned_at = now
+        try:
+            deleted = self.sql_manager.prune_jobs(self.job_retention_days)
+        except Exception as e:
+            logging.error(f"Error pruning finished jobs: {e}")
+            return 0
+        if deleted:
+            logging.debug(f"Deleted {deleted} jobs finished more than {self.job_retention_days:g} days ago")
+        return deleted
+
+    def send_alert(self, analysis_data, on_sent=None, on_rejected=None, key=None):
+        """Send (or queue) a phishing alert for an analysis, returns True when it was sent or queued
+
+        An alert whose key (job id) is still in the sender queue is not queued again.
+        """
+        try:
+            if os.getenv("SEND_EMAIL_ALERTS", "false").lower() != "true":
+                return False
+            subject = f"Phishing Alert: {analysis_data['subject']}"
+            html_sender = EmailSender.generate_phishing_warning(
+                json_data=analysis_data,
+                template_name=os.path.join(os.getenv("ALERT_TEMPLATE"))
             )
-            return oldest_file
+            if self.alert_sender is not None:
+                return self.alert_sender.enqueue(
+                    subject=subject,
+                    html_sender=html_sender,
+                    summary={
+                        'subject': analysis_data['subject'],
+                        'from': analysis_data['from'],
+                        'date': analysis_data['date']
+                    },
+                    on_sent=on_sent,
+                    on_rejected=on_rejected,
+                    key=key
+                )
+
+            EmailSender.send_email(subject=subject, html_sender=html_sender)
+            if on_sent:
+                on_sent()
+            return True
         except Exception as e:
-            logging.error(f"Error getting oldest email: {e}")
-            return None
+            logging.error(f"Error sending alert for {analysis_data['filename']}: {e}")
+            return False
+
+    def process_next_job(self):
+        """Claim the next queued email and process it, returns (job, result)"""
+        try:
+            job = self.sql_manager.claim_job(self.worker_id(), self.lease_seconds)
+        except Exception as e:
+            logging.error(f"Error claiming job: {e}")
+            return None, None
+        if not job:
+            return None, None
+
+        if job['attempts'] > self.max_attempts:
+            self.sql_manager.fail_job(job, "Lease expired too many times", self.max_attempts, self.retry_backoff)
+            logging.error(f"Giving up on {job['filename']} after {job['attempts'] - 1} attempts")
+            return job, None
+
+        result = self.process_single_email(job['filename'], job=job)
+        if not result:
+            state = self.sql_manager.fail_job(job, self.last_error or "Processing failed", self.max_attempts, self.retry_backoff)
+            logging.debug(f"Job {job['id']} ({job['filename']}) returned to state: {state}")
+        return job, result
 
     def process_emails(self):
-        """Process all emails in the folder sequentially, return when no emails remain"""
-        if self._processing:
-            logging.debug("Already processing an email, skipping")
-            return None
-        
-        self._processing = True
+        """Process queued emails until the queue is empty, within the flow controller's concurrency"""
         processed_count = 0
         results = []
         try:
             while self.running and not self.stop_event.is_set():
-                filename = self.get_oldest_email()
-                if not filename:
+                if not self.flow.acquire(self.stop_event):
+                    break
+                try:
+                    job, result = self.process_next_job()
+                finally:
+                    self.flow.release()
+                if not job:
                     logging.debug("No more emails to process")
                     break
-                
-                logging.debug(f"Processing oldest email: {filename}")
-                result = self.process_single_email(filename)
-                
+
+                # Failed calls count as errors only, their duration is not an LLM latency
+                self.flow.observe(self.stage_timings.get('llm') if result else None, bool(result))
                 if result:
                     processed_count += 1
                     results.append(result)
-                    logging.debug(f"Successfully processed: {filename}")
+                    logging.debug(f"Successfully processed: {job['filename']}")
                 else:
-                    logging.error(f"Failed to process: {filename}")
-                
-                # Small pause to avoid overloading
-                time.sleep(0.5)
-            
-            if processed_count > 0:
+                    logging.error(f"Failed to process: {job['filename']}")
+                    # Back off while the LLM keeps failing instead of burning through the retries
+                    self.stop_event.wait(self.flow.error_backoff())
+
+            # One export at a time when several threads drain the queue
+            if processed_count > 0 and self._export_lock.acquire(blocking=False):
                 try:
                     self.sql_manager.export_to_sql_file()
                     logging.debug(f"Processed {processed_count} emails and exported to SQL.")
                 except Exception as e:
                     logging.error(f"Error exporting to SQL: {e}")
-            
+                finally:
+                    self._export_lock.release()
+
             return results if results else None
         except Exception as e:
             logging.error(f"Error in process_emails: {e}")
             return None
-        finally:
-            self._processing = False
+
+    def run_worker_thread(self):
+        """Drain the queue, then wait for new jobs with an adaptive idle wait"""
+        while self.running and not self.stop_event.is_set():
+            if not self.process_emails():
+                self.resend_alerts()
+                self.prune_jobs()
+                wait = self.flow.idle_wait()
+                logging.debug(f"Waiting up to {wait:.0f} seconds for new emails...")
+                self.flow.wait_for_work(wait)
 
     def start(self):
-        """Start processing emails sequentially, wait when folder is empty"""        
+        """Start processing emails with up to FLOW_MAX_CONCURRENCY threads, wait when the queue is empty"""
+        # Alerts lost by a previous run
+        self.resend_alerts(force=True)
+        threads = [threading.Thread(target=self.run_worker_thread, daemon=True)
+                   for _ in range(self.flow.max_concurrency - 1)]
+        for thread in threads:
+            thread.start()
         try:
-            while self.running and not self.stop_event.is_set():
-                # Process all emails in the folder
-                result = self.process_emails()
-                if not result:  # No emails were processed (folder is empty)
-                    logging.debug(f"Waiting {self.interval} seconds for new emails...")
-                    time.sleep(self.interval)
-                # Continue immediately if emails were processed
+            self.run_worker_thread()
         except KeyboardInterrupt:
             logging.debug("Keyboard interrupt received")
         finally:
             self.stop()
-            
+            for thread in threads:
+                thread.join(timeout=5)
+
         logging.debug("Email processor stopped.")
 
     def stop(self):
@@ -287,6 +563,7 @@ class EmailProcessor:
         logging.debug("Stopping email processor...")
         self.running = False
         self.stop_event.set()
+        self.flow.notify()
         try:
             if hasattr(self.sql_manager, 'close'):
                 self.sql_manager.close()
@@ -297,19 +574,12 @@ class EmailProcessor:
     def get_processing_stats(self):
         """Get processing statistics"""
         try:
-            if not os.path.exists(self.emails_folder):
-                return {"pending": 0, "processed": 0}
-                
-            eml_files = [f for f in os.listdir(self.emails_folder) if f.endswith('.eml')]
-            processed_files = []
-            
-            if os.path.exists(self.processed_folder):
-                processed_files = [f for f in os.listdir(self.processed_folder) if f.endswith('.eml')]
-            
+            counts = self.sql_manager.get_job_counts()
             return {
-                "pending": len(eml_files),
-                "processed": len(processed_files)
+                "pending": counts.get('queued', 0) + counts.get('claimed', 0),
+                "processed": sum(counts.get(state, 0) for state in ('analyzed', 'alert_pending', 'alerted', 'alert_failed')),
+                "failed": counts.get('failed', 0)
             }
         except Exception as e:
             logging.error(f"Error getting processing stats: {e}")
-            return {"pending": 0, "processed": 0}
\ No newline at end of file
+            return {"pending": 0, "processed": 0, "failed": 0}
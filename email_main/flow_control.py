@@ -0,0 +1,174 @@
+import logging
+import math
+import os
+import threading
+import time
+from email.utils import parseaddr
+
+# Job priorities, higher values are claimed first
+PRIORITY_INTERNAL = 0
+PRIORITY_EXTERNAL = 1
+
+
+def sender_priority(sender, internal_domains=None):
+    """Job priority of an email: external senders before internal ones (INTERNAL_DOMAINS)"""
+    if internal_domains is None:
+        internal_domains = os.getenv("INTERNAL_DOMAINS", "")
+    domains = [d.strip().lower().lstrip('@') for d in internal_domains.split(',') if d.strip()]
+    address = parseaddr(str(sender or ''))[1].lower()
+    domain = address.rpartition('@')[2]
+    if domain and any(domain == d or domain.endswith('.' + d) for d in domains):
+        return PRIORITY_INTERNAL
+    return PRIORITY_EXTERNAL
+
+
+class FlowController:
+    """Adaptive backpressure between the IMAP monitor and the processors
+
+    Every processed email feeds the LLM latency and error rate EWMAs. From
+    them and the job queue depth it derives:
+    - the IMAP fetch batch size, zero (paused) from the high watermark until
+      the queue drains below the low watermark
+    - the processor concurrency, increased by one while the queue is deep and
+      halved when the LLM slows down or keeps failing (AIMD)
+    - the idle wait, growing from FLOW_MIN_IDLE_WAIT to WAIT_INTERVAL_LLM
+      while the queue stays empty; notify() ends it as soon as work is queued
+    """
+
+    def __init__(self, sql_manager):
+        self.sql_manager = sql_manager
+        self.high_watermark = int(os.getenv("FLOW_HIGH_WATERMARK", 200))
+        self.low_watermark = int(os.getenv("FLOW_LOW_WATERMARK", 50))
+        self.max_fetch_batch = int(os.getenv("FLOW_MAX_FETCH_BATCH", 50))
+        self.max_concurrency = max(1, int(os.getenv("FLOW_MAX_CONCURRENCY", 1)))
+        self.min_idle_wait = float(os.getenv("FLOW_MIN_IDLE_WAIT", 1))
+        self.max_idle_wait = float(os.getenv("WAIT_INTERVAL_LLM", 60))
+        self.max_error_rate = float(os.getenv("FLOW_MAX_ERROR_RATE", 0.2))
+        self.latency_tolerance = float(os.getenv("FLOW_LATENCY_TOLERANCE", 2.0))
+        self.alpha = float(os.getenv("FLOW_EWMA_ALPHA", 0.2))
+        self.depth_refresh = float(os.getenv("FLOW_DEPTH_REFRESH", 1))
+
+        self.latency = None
+        self.baseline = None
+        self.error_rate = 0.0
+        self.failures = 0
+        self.empty_polls = 0
+        self.limit = 1.0
+        self.active = 0
+        self.paused = False
+        self.last_decrease = 0.0
+        self.depth = 0
+        self.depth_at = 0.0
+
+        self.lock = threading.Lock()
+        self.slots = threading.Condition(self.lock)
+        self.wake = threading.Event()
+
+    def queue_depth(self, refresh=False):
+        """Jobs waiting or in progress, read from the job table at most every FLOW_DEPTH_REFRESH seconds"""
+        now = time.monotonic()
+        if refresh or now - self.depth_at >= self.depth_refresh:
+            try:
+                self.depth = self.sql_manager.get_queue_depth()
+                self.depth_at = now
+            except Exception as e:
+                logging.error(f"Error reading queue depth: {e}")
+        return self.depth
+
+    def observe(self, latency, success):
+        """Record one processed email (LLM latency in seconds, None if the LLM was not called)"""
+        depth = self.queue_depth()
+        with self.lock:
+            self.empty_polls = 0
+            self.failures = 0 if success else self.failures + 1
+            self.error_rate += self.alpha * ((0.0 if success else 1.0) - self.error_rate)
+            if latency is not None:
+                self.latency = latency if self.latency is None else self.latency + self.alpha * (latency - self.latency)
+                # Best latency seen, drifting up slowly so it follows a model change
+                if self.baseline is None or self.latency < self.baseline:
+                    self.baseline = self.latency
+                else:
+                    self.baseline += 0.01 * (self.latency - self.baseline)
+
+            limit = self.limit
+            slow = self.baseline and self.latency > self.baseline * self.latency_tolerance
+            if self.error_rate > self.max_error_rate or slow:
+                # At most one decrease per LLM round trip
+                now = time.monotonic()
+                if now - self.last_decrease >= (self.latency or 0):
+                    self.limit = max(1.0, self.limit / 2)
+                    self.last_decrease = now
+            elif depth > self.limit:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+
+            if int(limit) != int(self.limit):
+                logging.debug(f"Processor concurrency {int(limit)} -> {int(self.limit)} "
+                              f"(latency {self.latency or 0:.2f}s, errors {self.error_rate:.0%}, queue {depth})")
+                self.slots.notify_all()
+
+    def concurrency(self):
+        """Number of emails that may be processed at the same time"""
+        return int(self.limit)
+
+    def acquire(self, stop_event, timeout=1):
+        """Wait for a processing slot, returns False if stop_event is set first"""
+        with self.slots:
+            while self.active >= int(self.limit):
+                if stop_event.is_set():
+                    return False
+                self.slots.wait(timeout)
+            if stop_event.is_set():
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self.slots:
+            self.active -= 1
+            self.slots.notify()
+
+    def error_backoff(self):
+        """Pause after a failed email, growing while the error rate stays above FLOW_MAX_ERROR_RATE"""
+        with self.lock:
+            if self.error_rate <= self.max_error_rate:
+                return 0
+            return min(self.max_idle_wait, self.min_idle_wait * 2 ** min(self.failures, 16))
+
+    def idle_wait(self):
+        """Wait before polling an empty queue again, doubling on every empty poll"""
+        with self.lock:
+            self.empty_polls += 1
+            return min(self.max_idle_wait, self.min_idle_wait * 2 ** min(self.empty_polls - 1, 16))
+
+    def wait_for_work(self, timeout):
+        """Sleep until notify() or the timeout, returns True if woken by new work"""
+        woken = self.wake.wait(timeout)
+        self.wake.clear()
+        return woken
+
+    def notify(self):
+        """Wake idle processors, e.g. after the monitor queued new emails"""
+        with self.lock:
+            self.empty_polls = 0
+        self.wake.set()
+
+    def fetch_batch_size(self, interval):
+        """Unread emails the monitor may fetch now, 0 while the queue is above the watermarks"""
+        depth = self.queue_depth(refresh=True)
+        with self.lock:
+            if self.paused and depth <= self.low_watermark:
+                self.paused = False
+                logging.info(f"Queue down to {depth} jobs, resuming IMAP fetch")
+            elif not self.paused and depth >= self.high_watermark:
+                self.paused = True
+                logging.warning(f"Queue at {depth} jobs, pausing IMAP fetch until it drops to {self.low_watermark}")
+            if self.paused:
+                return 0
+
+            # What the processors can analyze until the next check, plus a buffer up to the low watermark
+            if self.latency:
+                capacity = math.ceil(int(self.limit) * interval / self.latency)
+            else:
+                capacity = self.max_fetch_batch
+            batch = capacity + max(0, self.low_watermark - depth)
+            return max(1, min(batch, self.high_watermark - depth, self.max_fetch_batch))
@@ -1,16 +1,22 @@
-import dkim
 import re
 
-def dkim_passes_from_bytes(eml_bytes, enable=False):
+def dkim_passes_from_bytes(eml_bytes, enable=False, dnsfunc=None):
     debug_msgs = []
     if not enable:
         return debug_msgs
-    # Look for raw DKIM-Signature header
+    # Imported on first use (loads the crypto backends); a missing dkimpy must not look like a DKIM result
+    import dkim
+    # Look for the first raw DKIM-Signature header (the one dkim.verify checks), unfolded
     dkim_signature = None
     for line in eml_bytes.split(b"\n"):
-        if line.lower().startswith(b"dkim-signature:"):
+        if not line.strip():
+            break  # end of the headers
+        if dkim_signature is not None:
+            if line[:1] not in (b" ", b"\t"):
+                break
+            dkim_signature += " " + line.decode(errors="ignore").strip()
+        elif line.lower().startswith(b"dkim-signature:"):
             dkim_signature = line.decode(errors="ignore").strip()
-            break
 
     if not dkim_signature:
         debug_msgs.append("DKIM-Signature header NOT found.")
@@ -21,8 +27,9 @@ def dkim_passes_from_bytes(eml_bytes, enable=False):
     # Extract selector (s=) and domain (d=) from signature
     selector = None
     domain = None
-    match_selector = re.search(r"s=([^;]+)", dkim_signature)
-    match_domain = re.search(r"d=([^;]+)", dkim_signature)
+    # Match whole tags only, so "d=" inside another tag value is not taken as the signing domain
+    match_selector = re.search(r"(?:^|[:;])\s*s=\s*([^;\s]+)", dkim_signature)
+    match_domain = re.search(r"(?:^|[:;])\s*d=\s*([^;\s]+)", dkim_signature)
     if match_selector:
         selector = match_selector.group(1)
         debug_msgs.append(f"DKIM Selector: {selector}")
@@ -37,7 +44,10 @@ def dkim_passes_from_bytes(eml_bytes, enable=False):
 
     # Verify DKIM and return result
     try:
-        valid = dkim.verify(eml_bytes)
+        if dnsfunc is not None:
+            valid = dkim.verify(eml_bytes, dnsfunc=dnsfunc)
+        else:
+            valid = dkim.verify(eml_bytes)
         result = "PASS" if valid else "FAIL"
     except Exception as e:
         result = f"ERROR ({e})"
@@ -1,5 +1,4 @@
 import logging
-import requests
 import time
 import re
 import json
@@ -12,7 +11,8 @@ def build_prompt(content, indicators, language="EN"):
         "2. Analyze the extracted domains: check if they are known legitimate domains or suspicious/fake ones.\n"
         "3. Review the email body: look for phishing signs such as urgency, suspicious links, requests for credentials, spelling mistakes, or spoofing.\n"
         "4. Use Google Safe Browsing results to check if any URLs are flagged as malicious.\n"
-        "5. Use other extracted indicators (emails, links, DKIM results) to complement your judgment.\n\n"
+        "5. Use other extracted indicators (emails, links, DKIM results) to complement your judgment.\n"
+        "6. Consider the sender reputation (verdicts of previous emails from the same sender and domain), but do not rely on it alone.\n\n"
         "Assign relative weights to each part (From, Domains, Body, Safe Browsing, Other Indicators) to build your confidence score.\n"
         "If evidence is weak or mixed, lower the confidence.\n\n"
         "Your response MUST be ONLY a valid JSON object in this exact format:\n\n"
@@ -29,6 +29,8 @@ def build_prompt(content, indicators, language="EN"):
         "- Use realistic confidence values reflecting the evidence strength.\n\n"
         "== EMAIL METADATA ==\n"
         f"From: {content['from']}\n\n"
+        "== SENDER REPUTATION ==\n"
+        f"{indicators.get('reputation') or 'None'}\n\n"
         "== EXTRACTED DOMAINS ==\n"
         f"{', '.join(indicators['domains']) or 'None'}\n\n"
         "== EMAIL BODY ==\n"
@@ -53,6 +55,7 @@ def extract_json(text):
 
 
 def check_phishing(content, indicators, ollama_api_url, model, auth_token, stream, language):
+    import requests  # deferred so that importing the processor stays fast
     prompt = build_prompt(content, indicators, language)
     
     headers = {
@@ -1,7 +1,7 @@
-import requests
 import logging
 
 def google_safe_browsing(url, api_key=None):
+    import requests  # deferred so that importing the processor stays fast
     # Check for API key
     if api_key is None:
         error_msg = "Google Safe Browsing API key not provided."
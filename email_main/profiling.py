@@ -0,0 +1,143 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import signal
+import threading
+import tracemalloc
+from datetime import datetime
+
+
+class Profiler:
+    """Runtime-toggleable cProfile/tracemalloc profiling of the running service
+
+    One profile covers the whole window, from start() to stop(). On Python
+    3.12+ an enabled cProfile records every thread of the process, so the
+    profile is not attached to single calls: the watched functions are
+    picked out of it in the reports instead.
+    """
+
+    def __init__(self, output_folder=None, window=None, top=None, frames=None):
+        self.output_folder = output_folder or os.getenv("PROFILE_OUTPUT_FOLDER", "profiles")
+        self.window = int(window or os.getenv("PROFILE_WINDOW", 300))
+        self.top = int(top or os.getenv("PROFILE_TOP", 30))
+        self.frames = int(frames or os.getenv("PROFILE_TRACEMALLOC_FRAMES", 5))
+        self.active = False
+        self._lock = threading.Lock()
+        self._timer = None
+        self._profile = None
+        self._watched = {}
+        self._snapshot = None
+        self._started_tracemalloc = False
+        self._started_at = None
+
+    def watch(self, obj, method_name, label=None):
+        """Add a report of obj.method_name (its calls and callees) to every dump"""
+        label = label or f"{type(obj).__name__}.{method_name}"
+        code = getattr(obj, method_name).__code__
+        # pstats names functions "file:line(name)"
+        self._watched[label] = re.escape(f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})")
+
+    def start(self, window=None):
+        """Open a profiling window that is dumped to disk when it expires"""
+        with self._lock:
+            if self.active:
+                logging.debug("Profiling already active")
+                return
+            window = int(window or self.window)
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError as e:
+                # Another profiler (or debugger) already holds the monitoring hooks
+                logging.error(f"Profiling not started: {e}")
+                return
+            self._profile = profile
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+                self._started_tracemalloc = True
+            self._snapshot = tracemalloc.take_snapshot()
+            self._started_at = datetime.now()
+            self.active = True
+
+            self._timer = threading.Timer(window, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+        logging.info(f"Profiling started for {window} seconds (output: {self.output_folder})")
+
+    def stop(self):
+        """Close the profiling window and write the pstats and allocation reports"""
+        with self._lock:
+            if not self.active:
+                return
+            self.active = False
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+
+            profile = self._profile
+            self._profile = None
+            profile.disable()
+
+            snapshot = tracemalloc.take_snapshot()
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+
+            try:
+                self._dump(profile, snapshot)
+            except Exception as e:
+                logging.error(f"Error writing profiling reports: {e}")
+
+    def toggle(self):
+        """Start profiling if idle, stop and dump if active"""
+        if self.active:
+            self.stop()
+        else:
+            self.start()
+
+    def install_signal_handler(self, signum=None):
+        """Toggle profiling on a signal (SIGUSR1 by default, where available)"""
+        signum = signum or getattr(signal, "SIGUSR1", None)
+        if signum is None:
+            logging.debug("No SIGUSR1 on this platform, profiling toggle by signal disabled")
+            return False
+
+        # Reports are written outside the signal handler to keep it short
+        signal.signal(signum, lambda *_: threading.Thread(target=self.toggle, daemon=True).start())
+        logging.debug(f"Profiling can be toggled with signal {signum} (pid {os.getpid()})")
+        return True
+
+    def _dump(self, profile, snapshot):
+        os.makedirs(self.output_folder, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+        pstats_path = os.path.join(self.output_folder, f"{timestamp}_profile.pstats")
+        profile.dump_stats(pstats_path)
+
+        report = io.StringIO()
+        stats = pstats.Stats(profile, stream=report).sort_stats("cumulative")
+        report.write(f"All threads, top {self.top} functions by cumulative time:\n")
+        stats.print_stats(self.top)
+        for label, function in self._watched.items():
+            report.write(f"\n{'=' * 20} {label} {'=' * 20}\n")
+            stats.print_stats(function)
+            stats.print_callees(function)
+        with open(pstats_path[:-len(".pstats")] + ".txt", 'w', encoding='utf-8') as f:
+            f.write(report.getvalue())
+        logging.info(f"Profile written to {pstats_path}")
+
+        allocations_path = os.path.join(self.output_folder, f"{timestamp}_allocations.txt")
+        with open(allocations_path, 'w', encoding='utf-8') as f:
+            f.write(f"Window: {self._started_at:%Y-%m-%d %H:%M:%S} -> {datetime.now():%Y-%m-%d %H:%M:%S}\n\n")
+            f.write(f"Top {self.top} allocation growth by line:\n")
+            for stat in snapshot.compare_to(self._snapshot, 'lineno')[:self.top]:
+                f.write(f"{stat}\n")
+            f.write(f"\nTop {self.top} live allocations by traceback:\n")
+            for stat in snapshot.statistics('traceback')[:self.top]:
+                f.write(f"\n{stat}\n")
+                for line in stat.traceback.format():
+                    f.write(f"{line}\n")
+        logging.info(f"Allocation report written to {allocations_path}")
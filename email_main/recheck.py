@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from email import policy
+from email.parser import BytesParser
+
+import email_main.processor.llm as LLM
+
+
+def parse_hours(value):
+    """Parse an hour window such as "22-6" or "0-7,20-24" into a set of hours"""
+    hours = set()
+    for part in (value or "0-24").split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition('-')
+        start = int(start)
+        end = int(end) if end else start + 1
+        if start <= end:
+            hours.update(range(start, end))
+        else:  # wraps around midnight
+            hours.update(range(start, 24))
+            hours.update(range(0, end))
+    return {h % 24 for h in hours}
+
+
+class RecheckEngine:
+    """Background second opinion for low-confidence or disputed verdicts
+
+    Pending rows are fetched in batches during the configured off-peak hours
+    and sent to a second (usually larger) model with its own thread pool, so
+    the primary pipeline can keep running a small, fast model.
+    """
+
+    def __init__(self, processor, llm=LLM):
+        self.processor = processor
+        self.sql_manager = processor.sql_manager
+        self.llm = llm
+        self.model = os.getenv("RECHECK_MODEL")
+        self.ollama_url = os.getenv("RECHECK_OLLAMA_URL") or os.getenv("OLLAMA_URL")
+        self.max_threads = int(os.getenv("RECHECK_MAX_THREADS", 1))
+        self.batch_size = int(os.getenv("RECHECK_BATCH_SIZE", 20))
+        self.interval = int(os.getenv("RECHECK_INTERVAL", 300))
+        self.max_attempts = int(os.getenv("RECHECK_MAX_ATTEMPTS", 5))
+        # Rows running longer than this were left by a stopped or crashed engine
+        self.stale_after = int(os.getenv("RECHECK_STALE_AFTER", 3600))
+        self.hours = parse_hours(os.getenv("RECHECK_HOURS", "0-24"))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_threads)
+        self.running = True
+        self.stop_event = threading.Event()
+
+    def in_window(self, now=None):
+        """Check if rechecks are allowed at this time"""
+        return (now or datetime.now()).hour in self.hours
+
+    def recheck(self, row):
+        """Ask the recheck model for a second verdict on one stored analysis"""
+        analysis_id, filename, subject, sender, recipient, date, model, response = row
+        raw_email = self.processor.read_email(filename)
+        if raw_email is None:
+            logging.warning(f"Recheck skipped, email {filename} not found")
+            self.sql_manager.update_recheck(analysis_id, "Email file not found", self.model, status='error')
+            return None
+
+        email_message = BytesParser(policy=policy.default).parsebytes(raw_email)
+        components = self.processor.extract_email_components(raw_email)
+        if not components:
+            self.sql_manager.update_recheck(analysis_id, "Could not extract components", self.model, status='error')
+            return None
+
+        indicators = self.processor.extract_indicators(components['body'])
+        indicators['dkim'] = self.processor.dkim_processor.dkim_passes_from_bytes(raw_email, self.processor.dkim_enabled)
+        self.processor.check_safe_browsing(indicators)
+        if self.processor.reputation is not None:
+            indicators['reputation'] = self.processor.reputation.describe(
+                self.processor.reputation.lookup(email_message['From'])
+            )
+
+        result, duration, size = self.llm.check_phishing(
+            content={
+                'from': email_message['From'],
+                'subject': email_message['Subject'],
+                'body': re.sub(r'https?://[^\s]+', '', components['body'])
+            },
+            indicators=indicators,
+            ollama_api_url=self.ollama_url,
+            model=self.model,
+            auth_token=os.getenv("OLLAMA_AUTH_TOKEN"),
+            stream=os.getenv("OLLAMA_STREAM", "false").lower() == "true",
+            language=os.getenv("OLLAMA_RESPONSE_LANGUAGE")
+        )
+
+        if duration is None:
+            # Model unreachable, try again in a later batch until RECHECK_MAX_ATTEMPTS
+            status = self.sql_manager.retry_recheck(analysis_id, result, self.model, self.max_attempts)
+            logging.error(f"Recheck of {filename} failed ({status}): {result}")
+            return None
+
+        self.sql_manager.update_recheck(analysis_id, result, self.model)
+
+        first = json.loads(response) if response else {}
+        first_verdict = first.get('verdict') if isinstance(first, dict) else None
+        second_verdict = result.get('verdict') if isinstance(result, dict) else None
+        logging.info(f"Recheck of {filename}: {model} said {first_verdict}, {self.model} says {second_verdict}")
+
+        # The second opinion caught something the primary model missed
+        if second_verdict == 'phishing' and first_verdict != 'phishing':
+            self.processor.send_alert({
+                'filename': filename,
+                'subject': subject,
+                'from': sender,
+                'to': recipient,
+                'date': date,
+                'indicators': indicators,
+                'llm': {'model': self.model, 'response': result, 'duration': duration}
+            })
+        return result
+
+    def run_batch(self):
+        """Recheck one batch of pending rows, returns how many got a second verdict"""
+        # Rows left running by an engine that stopped go back to the queue once stale
+        reset = self.sql_manager.reset_running_recheck(self.stale_after)
+        if reset:
+            logging.debug(f"Requeued {reset} interrupted rechecks")
+
+        rows = self.sql_manager.claim_recheck_batch(self.batch_size)
+        if not rows:
+            return 0
+
+        logging.debug(f"Rechecking {len(rows)} analyses with {self.model}")
+        futures = [self.executor.submit(self.recheck, row) for row in rows]
+        completed = 0
+        for row, future in zip(rows, futures):
+            try:
+                if future.result() is not None:
+                    completed += 1
+            except Exception as e:
+                logging.error(f"Error rechecking analysis {row[0]}: {e}")
+                self.sql_manager.update_recheck(row[0], str(e), self.model, status='error')
+        return completed
+
+    def start(self):
+        """Recheck pending verdicts during the allowed hours until stopped"""
+        if not self.model:
+            logging.error("RECHECK_MODEL is not set, recheck engine not started")
+            return
+
+        logging.debug(f"Recheck engine started with {self.model} ({self.max_threads} threads)")
+        while self.running and not self.stop_event.is_set():
+            completed = 0
+            if self.in_window():
+                try:
+                    completed = self.run_batch()
+                except Exception as e:
+                    logging.error(f"Recheck error: {e}")
+            # Wait when idle, outside the window or when the model keeps failing
+            if not completed:
+                self.stop_event.wait(self.interval)
+
+        logging.debug("Recheck engine stopped.")
+
+    def stop(self):
+        """Stop the recheck engine"""
+        logging.debug("Stopping recheck engine...")
+        self.running = False
+        self.stop_event.set()
+        self.executor.shutdown(wait=True)
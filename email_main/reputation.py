@@ -0,0 +1,142 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from email_main.sqlmanager import CONFIDENCE_WEIGHTS, format_timestamp, sender_keys
+
+
+class ReputationStore:
+    """In-memory LRU front cache over the reputation table
+
+    Lookups are O(1) on a cache hit. Entries expire after a TTL so verdicts
+    stored by other worker processes are picked up.
+    """
+
+    def __init__(self, sql_manager, size=None, ttl=None):
+        self.sql_manager = sql_manager
+        self.size = int(size or os.getenv("REPUTATION_CACHE_SIZE", 10000))
+        self.ttl = float(ttl or os.getenv("REPUTATION_CACHE_TTL", 300))
+        self.shortcircuit = os.getenv("REPUTATION_SHORTCIRCUIT", "false").lower() == "true"
+        self.bad_min = int(os.getenv("REPUTATION_BAD_MIN", 5))
+        self.bad_days = int(os.getenv("REPUTATION_BAD_DAYS", 7))
+        self.trusted_min = int(os.getenv("REPUTATION_TRUSTED_MIN", 20))
+        self.trusted_days = int(os.getenv("REPUTATION_TRUSTED_DAYS", 30))
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, kind, value):
+        """Reputation record for one key, or None if never seen"""
+        key = (kind, value)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self.cache.move_to_end(key)
+                return entry[1]
+
+        record = self.sql_manager.get_reputation(kind, value)
+        with self.lock:
+            self.cache[key] = (now, record)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.size:
+                self.cache.popitem(last=False)
+        return record
+
+    def lookup(self, sender):
+        """Reputation of the sender address and its domain"""
+        try:
+            return {kind: self.get(kind, value) for kind, value in sender_keys(sender)}
+        except Exception as e:
+            logging.error(f"Error reading reputation for {sender}: {e}")
+            return {}
+
+    def record(self, sender, response):
+        """Apply a verdict just stored in the database to the cached records"""
+        verdict = response.get('verdict') if isinstance(response, dict) else None
+        with self.lock:
+            for key in sender_keys(sender):
+                entry = self.cache.get(key)
+                if entry is None:
+                    continue
+                record = entry[1]
+                if record is None or verdict not in ('phishing', 'legitimate'):
+                    # First verdict for this key, reload it on the next lookup
+                    self.cache.pop(key, None)
+                    continue
+                total = record['phishing_count'] + record['legitimate_count']
+                weight = CONFIDENCE_WEIGHTS.get(str(response.get('confidence', '')).lower(), 0)
+                record = dict(record)
+                record['phishing_count'] += verdict == 'phishing'
+                record['legitimate_count'] += verdict == 'legitimate'
+                record['confidence'] = (record['confidence'] * total + weight) / (total + 1)
+                record['last_verdict'] = verdict
+                record['last_seen'] = format_timestamp(time.time())
+                self.cache[key] = (entry[0], record)
+
+    @staticmethod
+    def describe(reputation):
+        """One line per key for the LLM prompt"""
+        lines = []
+        for kind, label in (('sender', 'Sender'), ('sender_domain', 'Sender domain')):
+            record = reputation.get(kind)
+            if record is None:
+                if kind in reputation:
+                    lines.append(f"{label}: never seen before")
+                continue
+            lines.append(
+                f"{label} {record['value']}: {record['phishing_count']} phishing, "
+                f"{record['legitimate_count']} legitimate, last verdict {record['last_verdict']}, "
+                f"first seen {record['first_seen']}"
+            )
+        return '\n'.join(lines) or 'None'
+
+    @staticmethod
+    def dkim_aligned(sender, dkim_lines):
+        """True if DKIM passed with a signing domain (d=) equal to or a parent of the From domain"""
+        lines = [str(line) for line in dkim_lines or []]
+        if 'DKIM Result: PASS' not in lines:
+            return False
+        signer = next((line[len('DKIM Domain: '):].strip().lower().rstrip('.')
+                       for line in lines if line.startswith('DKIM Domain: ')), '')
+        domain = sender.rpartition('@')[2].lower().rstrip('.')
+        return bool(signer and domain) and (domain == signer or domain.endswith('.' + signer))
+
+    def short_circuit(self, reputation, indicators):
+        """Verdict for known-bad or long-trusted senders, None when the LLM is needed"""
+        if not self.shortcircuit:
+            return None
+
+        # Only exact addresses, and only while the last LLM verdict is recent: shortcut
+        # verdicts are not counted, so the LLM must look again now and then
+        record = reputation.get('sender')
+        bad_since = format_timestamp(time.time() - self.bad_days * 86400)
+        if (record and record['phishing_count'] >= self.bad_min and record['legitimate_count'] == 0
+                and (record['last_seen'] or '') >= bad_since):
+            return {
+                'verdict': 'phishing',
+                'confidence': 'high',
+                'reasons': [
+                    f"{record['value']} was classified as phishing {record['phishing_count']} times",
+                    "It was never classified as legitimate",
+                    "Verdict taken from the sender reputation without LLM analysis"
+                ]
+            }
+
+        # Trust only the exact address, with a DKIM signature of its own domain and clean URLs
+        trusted_since = format_timestamp(time.time() - self.trusted_days * 86400)
+        if (record and record['legitimate_count'] >= self.trusted_min and record['phishing_count'] == 0
+                and (record['first_seen'] or '') <= trusted_since
+                and self.dkim_aligned(record['value'], indicators.get('dkim'))
+                and not indicators.get('google_safe_browsing')):
+            return {
+                'verdict': 'legitimate',
+                'confidence': 'high',
+                'reasons': [
+                    f"{record['value']} was classified as legitimate {record['legitimate_count']} times",
+                    f"Known sender since {record['first_seen']} with no phishing verdicts",
+                    "DKIM signature is valid and no URL is flagged by Safe Browsing"
+                ]
+            }
+        return None
@@ -1,53 +1,130 @@
 from email.mime.text import MIMEText
 import html
 import logging
+import re
 import smtplib
 import os
+import queue
+import threading
+import time
+
+TEMPLATE_FOLDER = os.path.join(os.path.dirname(__file__), 'static')
+PLACEHOLDER_PATTERN = re.compile(r'\$(subject|from|date|confidence|reasons|domains|emails)\b')
+
+class AlertTemplate:
+    """Template HTML pré-dividido em segmentos, recarregado quando o ficheiro muda.
+
+    Os índices pares de segments são texto literal e os ímpares nomes de
+    placeholders, por isso render() faz um único join.
+    """
+
+    def __init__(self, path, reload_interval=2.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.mtime = None
+        self.checked_at = 0
+        self.segments = []
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Lê e divide o template."""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Template HTML não encontrado em: {self.path}")
+        with open(self.path, 'r', encoding='utf-8') as file:
+            segments = PLACEHOLDER_PATTERN.split(file.read())
+        self.segments, self.mtime = segments, mtime
+        logging.debug(f"Template carregado: {self.path}")
+
+    def refresh(self):
+        """Recarrega o template se o ficheiro tiver sido alterado."""
+        now = time.monotonic()
+        if now - self.checked_at < self.reload_interval:
+            return
+        with self.lock:
+            self.checked_at = now
+            try:
+                if os.stat(self.path).st_mtime != self.mtime:
+                    self.load()
+            except Exception as e:
+                # Mantém a última versão válida
+                logging.error(f"Erro ao recarregar template {self.path}: {e}")
+
+    def render(self, values):
+        """Preenche os placeholders (valores já escapados)."""
+        self.refresh()
+        parts = self.segments[:]
+        for i in range(1, len(parts), 2):
+            parts[i] = values.get(parts[i], '')
+        return ''.join(parts)
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+def get_template(template_name):
+    """Devolve o template compilado, lendo-o do disco apenas na primeira vez."""
+    template = _templates.get(template_name)
+    if template is None:
+        with _templates_lock:
+            template = _templates.get(template_name)
+            if template is None:
+                template = AlertTemplate(
+                    os.path.join(TEMPLATE_FOLDER, template_name),
+                    float(os.getenv("TEMPLATE_RELOAD_INTERVAL", 2))
+                )
+                _templates[template_name] = template
+    return template
+
+def preload_templates(*template_names):
+    """Compila os templates no arranque (todos os de static/ se nenhum for indicado)."""
+    names = template_names or [f for f in os.listdir(TEMPLATE_FOLDER) if f.endswith('.html')]
+    for name in names:
+        if name:
+            get_template(name)
+
+def html_list(values):
+    """Converte uma lista em itens <li> escapados (vazio se não houver valores)."""
+    return ''.join(f'<li>{html.escape(str(value))}</li>' for value in values or [])
 
 def generate_phishing_warning(json_data, template_name):
     """Gera o HTML preenchido com base no JSON e no template."""
-    print(template_name)
-    # Verificar se o template existe em static/
-    template_path = os.path.join(os.path.dirname(__file__), 'static', template_name)
-    if not os.path.exists(template_path):
-        raise FileNotFoundError(f"Template HTML não encontrado em: {template_path}")
-
-    # Ler o template HTML
-    with open(template_path, 'r', encoding='utf-8') as file:
-        template = file.read()
+    template = get_template(template_name)
 
     # Extrair os dados do JSON
-    subject = html.escape(json_data.get('subject', 'Desconhecido'))
-    from_email = html.escape(json_data.get('from', 'Desconhecido'))
-    to_email = html.escape(json_data.get('to').split('<')[-1].strip('>'))
-    date = html.escape(json_data.get('date', 'Desconhecida'))
-    confidence = json_data['llm']['response'].get('confidence', 0)
-    reasons = html.escape(' '.join(json_data['llm']['response'].get('reasons', ['Nenhuma razão fornecida.'])))
-    
-    # Processar listas com loops
-    emails = json_data['indicators'].get('emails', [])
-    emails_html = ''.join(f'<li>{html.escape(email)}</li>' for email in emails)
-    domains = json_data['indicators'].get('domains', [])
-    domains_html = ''.join(f'<li>{html.escape(domain)}</li>' for domain in domains)
-
-    # Substituir os placeholders no template
-    template = template.replace('$subject', subject)
-    template = template.replace('$from', from_email)
-    template = template.replace('$date', date)
-    template = template.replace('$confidence', confidence)
-    template = template.replace('$reasons', reasons)
-    template = template.replace('$domains', domains_html if domains else None)
-    template = template.replace('$emails', emails_html if emails else None)
-    return template, to_email
+    response = json_data['llm']['response']
+    response = response if isinstance(response, dict) else {}
+    reasons = response.get('reasons') or ['Nenhuma razão fornecida.']
+    if isinstance(reasons, str):
+        reasons = [reasons]
+    indicators = json_data.get('indicators') or {}
+
+    to_email = html.escape((json_data.get('to') or '').split('<')[-1].strip('>'))
+    body = template.render({
+        'subject': html.escape(str(json_data.get('subject') or 'Desconhecido')),
+        'from': html.escape(str(json_data.get('from') or 'Desconhecido')),
+        'date': html.escape(str(json_data.get('date') or 'Desconhecida')),
+        'confidence': html.escape(str(response.get('confidence', 0))),
+        'reasons': html.escape(' '.join(str(reason) for reason in reasons)),
+        'domains': html_list(indicators.get('domains')),
+        'emails': html_list(indicators.get('emails'))
+    })
+    return body, to_email
+
+def build_message(subject, body, to_address):
+    """Cria a mensagem HTML a enviar."""
+    msg = MIMEText(body, 'html')
+    msg['Subject'] = subject
+    msg['From'] = os.getenv("SENDER_EMAIL")
+    msg['To'] = to_address
+    return msg
 
 def send_email(subject, html_sender):
     """Envia um email usando SMTP com o corpo em HTML."""
     try:
         body, to_address = html_sender
-        msg = MIMEText(body, 'html')
-        msg['Subject'] = subject
-        msg['From'] = os.getenv("SENDER_EMAIL")
-        msg['To'] = to_address
+        msg = build_message(subject, body, to_address)
         
         # Conectar ao servidor SMTP
         with smtplib.SMTP(os.getenv("SENDER_SERVER"), os.getenv("SENDER_PORT")) as server:
@@ -58,3 +135,202 @@ def send_email(subject, html_sender):
     except Exception as e:
         logging.error(f"Erro ao enviar email: {e}")
         raise
+
+def generate_digest(alerts):
+    """Gera o HTML de um resumo com vários alertas para o mesmo destinatário."""
+    # Alertas repetidos da mesma campanha (assunto + remetente) aparecem uma só vez
+    campaigns = {}
+    for alert in alerts:
+        key = (alert['summary'].get('subject'), alert['summary'].get('from'))
+        campaigns.setdefault(key, []).append(alert['summary'])
+
+    rows = []
+    for (subject, sender), items in campaigns.items():
+        dates = sorted(str(item.get('date') or '') for item in items)
+        rows.append(
+            '<tr>'
+            f'<td>{html.escape(str(subject or ""))}</td>'
+            f'<td>{html.escape(str(sender or ""))}</td>'
+            f'<td>{len(items)}</td>'
+            f'<td>{html.escape(dates[-1])}</td>'
+            '</tr>'
+        )
+    return (
+        '<!DOCTYPE html><html><body style="font-family: \'Segoe UI\', Roboto, sans-serif;">'
+        f'<h2 style="color: #dc2626;">{len(alerts)} suspicious emails detected</h2>'
+        '<p>The following messages sent to you were classified as phishing. Do not open their links or attachments.</p>'
+        '<table cellpadding="6" style="border-collapse: collapse;" border="1">'
+        '<tr><th>Subject</th><th>From</th><th>Count</th><th>Last received</th></tr>'
+        f'{"".join(rows)}'
+        '</table></body></html>'
+    )
+
+def is_permanent(error):
+    """Erros SMTP que uma nova tentativa não resolve (respostas 5xx, destinatários recusados)"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(500 <= code < 600 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+class AlertSender:
+    """Fila de alertas enviada por uma thread dedicada.
+
+    Reutiliza uma sessão SMTP autenticada (com reconexão), repete os envios
+    falhados com backoff e junta alertas do mesmo destinatário num resumo.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.coalesce_window = float(os.getenv("ALERT_COALESCE_WINDOW", 5))
+        self.max_retries = int(os.getenv("ALERT_MAX_RETRIES", 5))
+        self.retry_backoff = float(os.getenv("ALERT_RETRY_BACKOFF", 5))
+        self.idle_timeout = float(os.getenv("SMTP_IDLE_TIMEOUT", 60))
+        self.server = None
+        self.last_used = 0
+        self.running = True
+        self.stop_event = threading.Event()
+        # Chaves (id do job) dos alertas na fila ou em envio, para não os repetir
+        self.queued_keys = set()
+        self.keys_lock = threading.Lock()
+
+    def enqueue(self, subject, html_sender, summary=None, on_sent=None, on_rejected=None, key=None):
+        """Coloca um alerta na fila de envio.
+
+        on_sent é chamado após o envio, on_rejected se o servidor recusar a
+        mensagem ou o destinatário de forma definitiva. Um alerta cuja key
+        ainda está na fila não é repetido; devolve False nesse caso.
+        """
+        if key is not None:
+            with self.keys_lock:
+                if key in self.queued_keys:
+                    return False
+                self.queued_keys.add(key)
+        body, to_address = html_sender
+        self.queue.put({
+            'subject': subject,
+            'body': body,
+            'to': to_address,
+            'summary': summary or {'subject': subject},
+            'on_sent': on_sent,
+            'on_rejected': on_rejected,
+            'key': key
+        })
+        return True
+
+    def connect(self):
+        """Abre e autentica a sessão SMTP."""
+        self.close()
+        server = smtplib.SMTP(os.getenv("SENDER_SERVER"), int(os.getenv("SENDER_PORT", 587)), timeout=30)
+        server.starttls()
+        server.login(os.getenv("SENDER_USERNAME"), os.getenv("SENDER_PASSWORD"))
+        self.server = server
+        logging.debug("Sessão SMTP estabelecida")
+
+    def close(self):
+        """Fecha a sessão SMTP, se existir."""
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except Exception:
+            pass  # A ligação já pode estar fechada
+        self.server = None
+
+    def send(self, subject, body, to_address):
+        """Envia uma mensagem pela sessão persistente, reconectando se necessário.
+
+        Devolve 'sent', 'rejected' (mensagem ou destinatário recusados de forma
+        definitiva) ou 'failed' (a reenviar mais tarde).
+        """
+        msg = build_message(subject, body, to_address)
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                if self.server is None:
+                    self.connect()
+                self.server.sendmail(msg['From'], [msg['To']], msg.as_string())
+                self.last_used = time.monotonic()
+                logging.debug(f"Email enviado para {to_address}")
+                return 'sent'
+            except (smtplib.SMTPException, OSError) as e:
+                # Erros 5xx não são repetidos: bloqueariam a thread de envio sem resultado
+                if is_permanent(e):
+                    logging.error(f"Email para {to_address} recusado pelo servidor: {e}")
+                    if isinstance(e, (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError)):
+                        return 'rejected'
+                    self.close()  # Autenticação ou remetente: configuração, reenviado mais tarde
+                    return 'failed'
+                self.close()
+                if attempt == self.max_retries:
+                    logging.error(f"Erro ao enviar email para {to_address} após {attempt} tentativas: {e}")
+                    return 'failed'
+                delay = self.retry_backoff * (2 ** (attempt - 1))
+                logging.warning(f"Erro ao enviar email para {to_address}, nova tentativa em {delay:.0f}s: {e}")
+                # Ao parar, as tentativas restantes são feitas sem esperar
+                self.stop_event.wait(delay)
+        return 'failed'
+
+    def collect(self):
+        """Espera pelo próximo alerta e junta os que chegam na janela de agregação."""
+        try:
+            alerts = [self.queue.get(timeout=1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.coalesce_window
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                alerts.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return alerts
+
+    def deliver(self, alerts):
+        """Envia os alertas, um resumo por destinatário quando há vários."""
+        by_recipient = {}
+        for alert in alerts:
+            by_recipient.setdefault(alert['to'], []).append(alert)
+
+        for to_address, items in by_recipient.items():
+            try:
+                if len(items) == 1:
+                    status = self.send(items[0]['subject'], items[0]['body'], to_address)
+                else:
+                    status = self.send(f"Phishing Alert: {len(items)} suspicious emails", generate_digest(items), to_address)
+            finally:
+                # Fora da fila: um alerta falhado pode voltar a ser colocado por quem o reenvia
+                with self.keys_lock:
+                    self.queued_keys.difference_update(item['key'] for item in items if item['key'] is not None)
+            if status == 'failed':
+                # Os jobs ficam em alert_pending e o processador volta a enviá-los
+                logging.error(f"Alertas não enviados para {to_address}: {len(items)}")
+                continue
+            callback = 'on_sent' if status == 'sent' else 'on_rejected'
+            for item in items:
+                if item.get(callback):
+                    try:
+                        item[callback]()
+                    except Exception as e:
+                        logging.error(f"Erro no callback do alerta: {e}")
+
+    def start(self):
+        """Envia os alertas da fila até ser parado."""
+        logging.debug("Alert sender started")
+        while self.running and not self.stop_event.is_set():
+            alerts = self.collect()
+            if alerts:
+                self.deliver(alerts)
+            elif self.server is not None and time.monotonic() - self.last_used > self.idle_timeout:
+                # Evita manter uma sessão que o servidor vai fechar
+                self.close()
+
+        # Envia o que ficou na fila antes de terminar
+        pending = []
+        while not self.queue.empty():
+            pending.append(self.queue.get_nowait())
+        if pending:
+            self.deliver(pending)
+        self.close()
+        logging.debug("Alert sender stopped")
+
+    def stop(self):
+        """Para a thread de envio."""
+        self.running = False
+        self.stop_event.set()
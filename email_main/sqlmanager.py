@@ -1,18 +1,77 @@
 import json
 import logging
+import math
+import re
 import sqlite3
+import time
+from datetime import datetime
+from email.utils import parseaddr
+
+CONFIDENCE_WEIGHTS = {'low': 0.33, 'medium': 0.66, 'high': 1.0}
+
+def sender_keys(sender):
+    """Chaves de reputação (tipo, valor) do remetente: endereço e domínio"""
+    address = parseaddr(str(sender or ''))[1].lower()
+    if '@' not in address:
+        return []
+    return [('sender', address), ('sender_domain', address.rsplit('@', 1)[1])]
+
+def indicator_values(analysis_data):
+    """Lista normalizada (tipo, valor) dos indicadores de uma análise"""
+    indicators = analysis_data.get('indicators') or {}
+    values = set()
+    values.update(('domain', d.lower()) for d in indicators.get('domains') or [])
+    values.update(('url', u) for u in indicators.get('urls') or [])
+    values.update(('email', e.lower()) for e in indicators.get('emails') or [])
+    values.update(sender_keys(analysis_data.get('from')))
+    return sorted(values)
+
+# Instruções do iterdump para o índice FTS5 (tabela virtual e tabelas sombra), que não se
+# podem restaurar tal como são escritas; export_to_sql_file recria o índice no fim do dump
+FTS_DUMP_STATEMENT = re.compile(
+    r"""^(?:CREATE TABLE ['"]?email_fts|INSERT INTO ['"]?email_fts|INSERT INTO sqlite_master\(.*'email_fts'|PRAGMA writable_schema)"""
+)
+
+# Histograma de latência com 4 classes por oitava (resolução de ~19%)
+LATENCY_BINS_PER_OCTAVE = 4
+
+def latency_bin(milliseconds):
+    """Classe do histograma de latência para uma duração em ms"""
+    if milliseconds <= 1:
+        return 0
+    return math.ceil(LATENCY_BINS_PER_OCTAVE * math.log2(milliseconds))
+
+def latency_bin_upper(bin_index):
+    """Limite superior (ms) de uma classe do histograma de latência"""
+    return 2 ** (bin_index / LATENCY_BINS_PER_OCTAVE)
+
+def format_timestamp(value):
+    """Converte datetime/epoch para o formato de CURRENT_TIMESTAMP (UTC)"""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, datetime):
+        value = value.timestamp()
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(value))
 
 class SQLManager:
     """Classe para gestão da base de dados SQL dos emails processados"""
     
-    def __init__(self, db_path="email_analysis.db"):
+    def __init__(self, db_path="email_analysis.db", timeout=30):
         self.db_path = db_path
+        self.timeout = timeout
+        self.fts_enabled = False
         self.init_database()
+
+    def _connect(self):
+        """Abre uma ligação à base de dados (partilhada por vários processos)"""
+        return sqlite3.connect(self.db_path, timeout=self.timeout)
     
     def init_database(self):
         """Inicializa a base de dados com as tabelas necessárias"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
+            # WAL permite leituras concorrentes enquanto um worker escreve
+            cursor.execute('PRAGMA journal_mode=WAL')
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS email_analysis (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -34,22 +93,185 @@ class SQLManager:
                     recheck_status TEXT,
                     recheck_response TEXT,
                     recheck_model TEXT,
-                    recheck_at TIMESTAMP
+                    recheck_at TIMESTAMP,
+                    recheck_attempts INTEGER NOT NULL DEFAULT 0,
+                    recheck_claimed_at TIMESTAMP
+                )
+            ''')
+            # Fila de trabalho persistente: queued -> claimed -> analyzed, ou
+            # alert_pending -> alerted (alert_failed se o servidor recusar o alerta;
+            # failed quando as tentativas se esgotam). available_at guarda a hora
+            # da próxima tentativa (queued) ou o fim do lease (claimed). Os jobs
+            # terminados são apagados por prune_jobs ao fim de JOB_RETENTION_DAYS.
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS email_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    filename TEXT NOT NULL UNIQUE,
+                    state TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    available_at REAL NOT NULL,
+                    lease_owner TEXT,
+                    last_error TEXT,
+                    analysis_id INTEGER,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            # Indicadores normalizados: cada valor é guardado uma vez e ligado às
+            # análises por email_indicator, cuja chave (indicador, data, análise)
+            # cobre as pesquisas por indicador num intervalo de tempo
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'indicator'")
+            backfill = cursor.fetchone() is None
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS indicator (
+                    id INTEGER PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    UNIQUE (kind, value)
                 )
             ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS email_indicator (
+                    indicator_id INTEGER NOT NULL,
+                    seen_at TEXT NOT NULL,
+                    analysis_id INTEGER NOT NULL,
+                    PRIMARY KEY (indicator_id, seen_at, analysis_id)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_email_indicator_analysis
+                ON email_indicator (analysis_id, indicator_id)
+            ''')
+            # Reputação por remetente e domínio, atualizada a cada análise
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'reputation'")
+            backfill_reputation = cursor.fetchone() is None
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS reputation (
+                    kind TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    phishing_count INTEGER NOT NULL DEFAULT 0,
+                    legitimate_count INTEGER NOT NULL DEFAULT 0,
+                    confidence_sum REAL NOT NULL DEFAULT 0,
+                    last_verdict TEXT,
+                    first_seen TEXT,
+                    last_seen TEXT,
+                    PRIMARY KEY (kind, value)
+                ) WITHOUT ROWID
+            ''')
+            # Agregados por hora/dia para o dashboard, mantidos a cada análise
+            # (bucket 'YYYY-MM-DD HH:00' para period='hour', 'YYYY-MM-DD' para 'day')
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rollup_verdicts'")
+            backfill_rollups = cursor.fetchone() is None
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS rollup_verdicts (
+                    period TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    verdict TEXT NOT NULL,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (period, bucket, verdict)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS rollup_latency (
+                    period TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    bin INTEGER NOT NULL,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (period, bucket, bin)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS rollup_domains (
+                    period TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    domain TEXT NOT NULL,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (period, bucket, kind, domain)
+                ) WITHOUT ROWID
+            ''')
+            # Índice de texto integral (rowid = id da análise); requer FTS5
+            try:
+                cursor.execute('''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS email_fts USING fts5(
+                        subject, sender, body, footer,
+                        tokenize = 'unicode61 remove_diacritics 2'
+                    )
+                ''')
+                self.fts_enabled = True
+            except sqlite3.OperationalError as e:
+                logging.warning(f"FTS5 indisponível, pesquisa de texto desativada: {e}")
+            # Posição de cada email arquivado nos segmentos comprimidos (ver archive.py)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS email_archive (
+                    filename TEXT PRIMARY KEY,
+                    segment TEXT NOT NULL,
+                    offset INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    raw_size INTEGER NOT NULL,
+                    compression TEXT NOT NULL,
+                    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                ) WITHOUT ROWID
+            ''')
+            # Bases de dados anteriores à contagem de tentativas e à hora de reserva do recheck
+            cursor.execute('PRAGMA table_info(email_analysis)')
+            columns = [column[1] for column in cursor.fetchall()]
+            if 'recheck_attempts' not in columns:
+                cursor.execute('ALTER TABLE email_analysis ADD COLUMN recheck_attempts INTEGER NOT NULL DEFAULT 0')
+            if 'recheck_claimed_at' not in columns:
+                cursor.execute('ALTER TABLE email_analysis ADD COLUMN recheck_claimed_at TIMESTAMP')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_email_analysis_recheck
+                ON email_analysis (recheck_status, id)
+            ''')
+            # Filas criadas antes da prioridade (maior valor = reservado primeiro)
+            cursor.execute('PRAGMA table_info(email_jobs)')
+            if 'priority' not in [column[1] for column in cursor.fetchall()]:
+                cursor.execute('ALTER TABLE email_jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 0')
+            cursor.execute('DROP INDEX IF EXISTS idx_email_jobs_claim')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_email_jobs_claim_priority
+                ON email_jobs (state, priority DESC, available_at)
+            ''')
             conn.commit()
+
+        # Bases de dados antigas: preencher os indicadores a partir dos campos JSON
+        if backfill:
+            self.backfill_indicators()
+        if backfill_reputation:
+            self.backfill_reputation()
+        if backfill_rollups:
+            self.backfill_rollups()
     
-    def save_analysis(self, analysis_data):
-        """Guarda a análise de um email na base de dados"""
+    def save_analysis(self, analysis_data, job=None, job_state='analyzed'):
+        """Guarda a análise de um email na base de dados
+
+        Se for indicado o job (obtido com claim_job), o job passa a job_state
+        ('analyzed', ou 'alert_pending' se falta enviar o alerta) na mesma
+        transação. Devolve o id da análise ou None em caso de erro.
+        """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
+                if job is not None:
+                    # O lease pode ter expirado e o job ter sido entregue a outro worker
+                    cursor.execute('''
+                        UPDATE email_jobs
+                        SET state = ?, last_error = NULL, updated_at = CURRENT_TIMESTAMP
+                        WHERE id = ? AND state = 'claimed' AND lease_owner = ?
+                    ''', (job_state, job['id'], job['lease_owner']))
+                    if cursor.rowcount == 0:
+                        conn.rollback()
+                        logging.warning(f"Job {job['id']} já não pertence a este worker, análise descartada: {analysis_data['filename']}")
+                        return None
+                processed_at = format_timestamp(time.time())
                 cursor.execute('''
                     INSERT INTO email_analysis 
                     (filename, subject, sender, recipient, date_received, footer, 
                      attachments_count, emails_found, urls_found, domains_found,
-                     size, llm_model, llm_response, llm_duration)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                     size, llm_model, llm_response, llm_duration, recheck_status, processed_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 ''', (
                     analysis_data['filename'],
                     analysis_data['subject'],
@@ -64,46 +286,534 @@ class SQLManager:
                     analysis_data['size'],
                     analysis_data['llm']['model'],
                     json.dumps(analysis_data['llm']['response']),
-                    analysis_data['llm']['duration']
+                    analysis_data['llm']['duration'],
+                    'pending' if analysis_data.get('recheck') else None,
+                    processed_at
                 ))
+                analysis_id = cursor.lastrowid
+                self._save_indicators(cursor, analysis_id, processed_at, indicator_values(analysis_data))
+                # Veredictos obtidos da própria reputação não a reforçam
+                if not analysis_data.get('reputation_hit'):
+                    self._update_reputation(cursor, analysis_data['from'], analysis_data['llm']['response'], processed_at)
+                self._update_rollups(cursor, processed_at, analysis_data)
+                if self.fts_enabled:
+                    cursor.execute('''
+                        INSERT INTO email_fts (rowid, subject, sender, body, footer)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', (
+                        analysis_id,
+                        str(analysis_data['subject'] or ''),
+                        str(analysis_data['from'] or ''),
+                        analysis_data.get('body') or '',
+                        analysis_data['footer'] or ''
+                    ))
+                if job is not None:
+                    cursor.execute('UPDATE email_jobs SET analysis_id = ? WHERE id = ?', (analysis_id, job['id']))
                 conn.commit()
                 logging.debug(f"Análise guardada na BD: {analysis_data['filename']}")
+                return analysis_id
         except Exception as e:
             logging.error(f"Erro ao guardar análise na BD: {e}")
+            return None
+
+    def _save_indicators(self, cursor, analysis_id, seen_at, values):
+        """Liga os indicadores (deduplicados) a uma análise, na transação do cursor"""
+        if not values:
+            return
+        cursor.executemany('INSERT OR IGNORE INTO indicator (kind, value) VALUES (?, ?)', values)
+        for kind, value in values:
+            cursor.execute('''
+                INSERT OR IGNORE INTO email_indicator (indicator_id, seen_at, analysis_id)
+                SELECT id, ?, ? FROM indicator WHERE kind = ? AND value = ?
+            ''', (seen_at, analysis_id, kind, value))
+
+    def _update_reputation(self, cursor, sender, response, seen_at):
+        """Soma um veredicto à reputação do remetente e do domínio"""
+        if not isinstance(response, dict) or response.get('verdict') not in ('phishing', 'legitimate'):
+            return
+        phishing = 1 if response['verdict'] == 'phishing' else 0
+        confidence = CONFIDENCE_WEIGHTS.get(str(response.get('confidence', '')).lower(), 0)
+        cursor.executemany('''
+            INSERT INTO reputation (kind, value, phishing_count, legitimate_count, confidence_sum,
+                                    last_verdict, first_seen, last_seen)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (kind, value) DO UPDATE SET
+                phishing_count = phishing_count + excluded.phishing_count,
+                legitimate_count = legitimate_count + excluded.legitimate_count,
+                confidence_sum = confidence_sum + excluded.confidence_sum,
+                last_verdict = excluded.last_verdict,
+                last_seen = excluded.last_seen
+        ''', [
+            (kind, value, phishing, 1 - phishing, confidence, response['verdict'], seen_at, seen_at)
+            for kind, value in sender_keys(sender)
+        ])
+
+    def _backfill(self, handler, description, batch_size=1000):
+        """Aplica handler(cursor, análise) a todas as análises existentes, em lotes"""
+        last_id = 0
+        total = 0
+        while True:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT id, sender, emails_found, urls_found, domains_found,
+                           llm_model, llm_response, llm_duration, processed_at
+                    FROM email_analysis WHERE id > ? ORDER BY id LIMIT ?
+                ''', (last_id, batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    try:
+                        response = json.loads(row[6]) if row[6] else None
+                    except ValueError:
+                        response = row[6]
+                    handler(cursor, {
+                        'id': row[0],
+                        'from': row[1],
+                        'indicators': {
+                            'emails': json.loads(row[2] or '[]'),
+                            'urls': json.loads(row[3] or '[]'),
+                            'domains': json.loads(row[4] or '[]')
+                        },
+                        'llm': {'model': row[5], 'response': response, 'duration': row[7]},
+                        'processed_at': row[8] or format_timestamp(time.time())
+                    })
+                conn.commit()
+                last_id = rows[-1][0]
+                total += len(rows)
+        if total:
+            logging.info(f"{description}: {total} análises")
+        return total
+
+    def backfill_indicators(self):
+        """Preenche as tabelas de indicadores a partir das análises existentes"""
+        return self._backfill(
+            lambda cursor, a: self._save_indicators(cursor, a['id'], a['processed_at'], indicator_values(a)),
+            "Indicadores preenchidos"
+        )
+
+    def backfill_reputation(self):
+        """Calcula a reputação a partir das análises existentes"""
+        def handler(cursor, a):
+            if a['llm']['model'] != 'reputation':
+                self._update_reputation(cursor, a['from'], a['llm']['response'], a['processed_at'])
+        return self._backfill(handler, "Reputação calculada")
+
+    def backfill_rollups(self):
+        """Calcula os agregados do dashboard a partir das análises existentes"""
+        return self._backfill(
+            lambda cursor, a: self._update_rollups(cursor, a['processed_at'], a),
+            "Agregados calculados"
+        )
+
+    def _update_rollups(self, cursor, processed_at, analysis_data):
+        """Atualiza os agregados por hora e por dia (veredictos, latência e domínios)"""
+        llm = analysis_data['llm']
+        response = llm['response']
+        verdict = response.get('verdict') if isinstance(response, dict) else None
+        if verdict not in ('phishing', 'legitimate'):
+            verdict = 'unknown'
+        # Veredictos da reputação não passaram pelo LLM
+        latency = llm['duration'] if llm['model'] != 'reputation' else None
+        domains = {('domain', d.lower()) for d in analysis_data['indicators'].get('domains') or []}
+        domains.update((kind, value) for kind, value in sender_keys(analysis_data.get('from')) if kind == 'sender_domain')
+
+        for period, bucket in (('hour', processed_at[:13] + ':00'), ('day', processed_at[:10])):
+            cursor.execute('''
+                INSERT INTO rollup_verdicts (period, bucket, verdict, count) VALUES (?, ?, ?, 1)
+                ON CONFLICT (period, bucket, verdict) DO UPDATE SET count = count + 1
+            ''', (period, bucket, verdict))
+            if latency is not None:
+                cursor.execute('''
+                    INSERT INTO rollup_latency (period, bucket, bin, count) VALUES (?, ?, ?, 1)
+                    ON CONFLICT (period, bucket, bin) DO UPDATE SET count = count + 1
+                ''', (period, bucket, latency_bin(latency * 1000)))
+            cursor.executemany('''
+                INSERT INTO rollup_domains (period, bucket, kind, domain, count) VALUES (?, ?, ?, ?, 1)
+                ON CONFLICT (period, bucket, kind, domain) DO UPDATE SET count = count + 1
+            ''', [(period, bucket, kind, domain) for kind, domain in domains])
+
+    def get_reputation(self, kind, value):
+        """Reputação de um remetente ('sender') ou domínio ('sender_domain')"""
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT phishing_count, legitimate_count, confidence_sum, last_verdict, first_seen, last_seen
+                FROM reputation WHERE kind = ? AND value = ?
+            ''', (kind, value))
+            row = cursor.fetchone()
+        if not row:
+            return None
+        return {
+            'kind': kind,
+            'value': value,
+            'phishing_count': row[0],
+            'legitimate_count': row[1],
+            'confidence': row[2] / (row[0] + row[1]) if row[0] + row[1] else 0,
+            'last_verdict': row[3],
+            'first_seen': row[4],
+            'last_seen': row[5]
+        }
+
+    def find_by_indicator(self, kind, value, since=None, until=None, limit=100):
+        """Análises que contêm um indicador, das mais recentes para as mais antigas
+
+        since/until aceitam datetime, epoch ou texto 'YYYY-MM-DD HH:MM:SS' (UTC).
+        """
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT a.id, a.filename, a.subject, a.sender, a.recipient,
+                       ei.seen_at, a.llm_model, a.llm_response
+                FROM indicator i
+                JOIN email_indicator ei ON ei.indicator_id = i.id
+                JOIN email_analysis a ON a.id = ei.analysis_id
+                WHERE i.kind = ? AND i.value = ?
+                  AND ei.seen_at >= ? AND ei.seen_at < ?
+                ORDER BY ei.seen_at DESC
+                LIMIT ?
+            ''', (kind, value, format_timestamp(since) or '', format_timestamp(until) or '9999', limit))
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def find_by_domain(self, domain, **kwargs):
+        """Análises com um domínio nos links do corpo"""
+        return self.find_by_indicator('domain', domain.lower(), **kwargs)
+
+    def find_by_url(self, url, **kwargs):
+        """Análises que contêm um URL"""
+        return self.find_by_indicator('url', url, **kwargs)
+
+    def find_by_sender(self, sender, **kwargs):
+        """Análises de um remetente (endereço completo ou apenas o domínio)"""
+        sender = parseaddr(sender)[1].lower() or sender.lower()
+        if '@' in sender:
+            return self.find_by_indicator('sender', sender, **kwargs)
+        return self.find_by_indicator('sender_domain', sender, **kwargs)
+
+    def search(self, query, limit=20, order='rank'):
+        """Pesquisa de texto integral (sintaxe FTS5) no assunto, remetente, corpo e rodapé
+
+        order='rank' ordena por relevância (bm25), order='recent' pelas análises
+        mais recentes, o que evita pontuar todos os resultados de termos comuns.
+        """
+        if not self.fts_enabled:
+            raise RuntimeError("Pesquisa de texto indisponível (SQLite sem FTS5)")
+        order_by = 'email_fts.rowid DESC' if order == 'recent' else 'rank'
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f'''
+                    SELECT a.id, a.filename, a.subject, a.sender, a.processed_at, a.llm_response,
+                           snippet(email_fts, 2, '[', ']', '...', 16) AS snippet
+                    FROM email_fts
+                    JOIN email_analysis a ON a.id = email_fts.rowid
+                    WHERE email_fts MATCH ?
+                    ORDER BY {order_by}
+                    LIMIT ?
+                ''', (query, limit))
+            except sqlite3.OperationalError as e:
+                raise ValueError(f"Pesquisa inválida '{query}': {e}")
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def enqueue_job(self, filename, priority=0):
+        """Adiciona um email à fila de processamento
+
+        Devolve True se o job foi criado, False se já existia e None em caso de erro.
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT OR IGNORE INTO email_jobs (filename, state, available_at, priority)
+                    VALUES (?, 'queued', ?, ?)
+                ''', (filename, time.time(), priority))
+                conn.commit()
+                return cursor.rowcount > 0
+        except Exception as e:
+            logging.error(f"Erro ao adicionar job {filename}: {e}")
+            return None
+
+    def claim_job(self, worker_id, lease_seconds=300):
+        """Reserva o próximo job disponível (queued ou com lease expirado), por prioridade
+
+        A reserva é um único UPDATE, atómico entre processos. Cada estado é
+        procurado à parte pela ordem do índice (state, priority, available_at),
+        primeiro os queued e depois os claimed com lease expirado, sem ordenar
+        todos os jobs prontos.
+        Devolve um dict com id, filename, attempts e lease_owner ou None.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE email_jobs
+                SET state = 'claimed',
+                    lease_owner = ?,
+                    available_at = ?,
+                    attempts = attempts + 1,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = COALESCE(
+                    (SELECT id FROM email_jobs
+                     WHERE state = 'queued' AND available_at <= ?
+                     ORDER BY priority DESC, available_at
+                     LIMIT 1),
+                    (SELECT id FROM email_jobs
+                     WHERE state = 'claimed' AND available_at <= ?
+                     ORDER BY priority DESC, available_at
+                     LIMIT 1)
+                )
+                RETURNING id, filename, attempts, lease_owner
+            ''', (worker_id, now + lease_seconds, now, now))
+            row = cursor.fetchone()
+            conn.commit()
+        if not row:
+            return None
+        return {'id': row[0], 'filename': row[1], 'attempts': row[2], 'lease_owner': row[3]}
+
+    def finish_alert(self, job, state):
+        """Regista o resultado do alerta de um job (alerted ou alert_failed)
+
+        Não depende do lease: o alerta pode ter sido colocado na fila antes de
+        outro worker reservar o job para o reenviar.
+        """
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE email_jobs
+                SET state = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND state = 'alert_pending'
+            ''', (state, job['id']))
+            conn.commit()
+            return cursor.rowcount > 0
+
+    def claim_unsent_alerts(self, worker_id, older_than=600, limit=100):
+        """Reserva os jobs com alerta por enviar há mais de older_than segundos
+
+        Cobre alertas perdidos num crash ou paragem e os descartados após as
+        tentativas de envio. Devolve uma lista de (job, analysis_data).
+        """
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE email_jobs
+                SET lease_owner = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT id FROM email_jobs
+                    WHERE state = 'alert_pending' AND updated_at <= ?
+                    LIMIT ?
+                )
+                RETURNING id, filename, attempts, lease_owner, analysis_id
+            ''', (worker_id, format_timestamp(time.time() - older_than), limit))
+            jobs = cursor.fetchall()
+            conn.commit()
+
+            pending = []
+            for job_id, filename, attempts, lease_owner, analysis_id in jobs:
+                cursor.execute('''
+                    SELECT subject, sender, recipient, date_received, emails_found, urls_found,
+                           domains_found, llm_model, llm_response, llm_duration
+                    FROM email_analysis WHERE id = ?
+                ''', (analysis_id,))
+                row = cursor.fetchone()
+                if row is None:
+                    continue
+                job = {'id': job_id, 'filename': filename, 'attempts': attempts, 'lease_owner': lease_owner}
+                pending.append((job, {
+                    'id': analysis_id,
+                    'filename': filename,
+                    'subject': row[0],
+                    'from': row[1],
+                    'to': row[2],
+                    'date': row[3],
+                    'indicators': {
+                        'emails': json.loads(row[4] or '[]'),
+                        'urls': json.loads(row[5] or '[]'),
+                        'domains': json.loads(row[6] or '[]')
+                    },
+                    'llm': {'model': row[7], 'response': json.loads(row[8] or 'null'), 'duration': row[9]}
+                }))
+            return pending
+
+    def fail_job(self, job, error, max_attempts=5, backoff_seconds=30):
+        """Devolve um job à fila com backoff exponencial, ou marca-o como 'failed'"""
+        if job['attempts'] >= max_attempts:
+            state, available_at = 'failed', time.time()
+        else:
+            state = 'queued'
+            available_at = time.time() + backoff_seconds * (2 ** (job['attempts'] - 1))
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE email_jobs
+                SET state = ?, available_at = ?, last_error = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND state = 'claimed' AND lease_owner = ?
+            ''', (state, available_at, str(error), job['id'], job['lease_owner']))
+            conn.commit()
+        return state
+
+    def get_job_counts(self):
+        """Número de jobs por estado"""
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT state, COUNT(*) FROM email_jobs GROUP BY state')
+            return dict(cursor.fetchall())
+
+    def get_queue_depth(self):
+        """Número de jobs à espera ou em curso (só lê estes estados no índice de reserva)"""
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM email_jobs WHERE state IN ('queued', 'claimed')")
+            return cursor.fetchone()[0]
+
+    def prune_jobs(self, older_than_days, batch_size=1000):
+        """Apaga os jobs terminados há mais de older_than_days dias, em lotes curtos
+
+        Os jobs com alerta por enviar (alert_pending) nunca são apagados.
+        Devolve o número de jobs apagados.
+        """
+        cutoff = format_timestamp(time.time() - older_than_days * 86400)
+        deleted = 0
+        while True:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    DELETE FROM email_jobs
+                    WHERE id IN (
+                        SELECT id FROM email_jobs
+                        WHERE state IN ('analyzed', 'alerted', 'alert_failed', 'failed') AND updated_at < ?
+                        LIMIT ?
+                    )
+                ''', (cutoff, batch_size))
+                conn.commit()
+            deleted += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                return deleted
     
+    def add_archive_entry(self, filename, segment, offset, length, raw_size, compression):
+        """Regista a posição de um email no arquivo"""
+        with self._connect() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO email_archive (filename, segment, offset, length, raw_size, compression)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (filename, segment, offset, length, raw_size, compression))
+            conn.commit()
+
+    def get_archive_entry(self, filename=None, analysis_id=None):
+        """Segmento, offset, tamanho e compressão de um email arquivado (por nome ou id da análise)"""
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            if analysis_id is not None:
+                cursor.execute('''
+                    SELECT ar.segment, ar.offset, ar.length, ar.compression
+                    FROM email_analysis a JOIN email_archive ar ON ar.filename = a.filename
+                    WHERE a.id = ?
+                ''', (analysis_id,))
+            else:
+                cursor.execute('''
+                    SELECT segment, offset, length, compression FROM email_archive WHERE filename = ?
+                ''', (filename,))
+            return cursor.fetchone()
+
+    def get_archive_stats(self):
+        """Número de emails arquivados, tamanho original e comprimido"""
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*), COALESCE(SUM(raw_size), 0), COALESCE(SUM(length), 0) FROM email_archive')
+            count, raw_size, stored = cursor.fetchone()
+            return {'count': count, 'raw_bytes': raw_size, 'stored_bytes': stored}
+
     def export_to_sql_file(self, output_file="email_analysis_export.sql"):
-        """Exporta os dados para um ficheiro SQL"""
+        """Exporta os dados para um ficheiro SQL (restaurável com sqlite3 nova.db < ficheiro.sql)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
+                fts_sql = conn.execute(
+                    "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'email_fts'"
+                ).fetchone()
                 with open(output_file, 'w', encoding='utf-8') as f:
                     for line in conn.iterdump():
+                        if FTS_DUMP_STATEMENT.match(line):
+                            continue
+                        if line == 'COMMIT;' and fts_sql:
+                            # Índice de texto com o rowid, que o liga ao id da análise
+                            f.write('%s;\n' % fts_sql[0])
+                            for (insert,) in conn.execute('''
+                                SELECT 'INSERT INTO email_fts (rowid, subject, sender, body, footer) VALUES ('
+                                       || rowid || ', ' || quote(subject) || ', ' || quote(sender) || ', '
+                                       || quote(body) || ', ' || quote(footer) || ');'
+                                FROM email_fts
+                            '''):
+                                f.write('%s\n' % insert)
                         f.write('%s\n' % line)
             logging.debug(f"Dados exportados para: {output_file}")
         except Exception as e:
             logging.error(f"Erro ao exportar SQL: {e}")
     
-    def get_pending_recheck(self):
-        """Obtém registos pendentes de recheck"""
-        with sqlite3.connect(self.db_path) as conn:
+    def claim_recheck_batch(self, limit=20):
+        """Reserva um lote de registos pendentes (pending -> running)"""
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                SELECT * FROM email_analysis 
-                WHERE recheck_status = 'pending'
-            ''')
-            return cursor.fetchall()
+                UPDATE email_analysis
+                SET recheck_status = 'running', recheck_claimed_at = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT id FROM email_analysis
+                    WHERE recheck_status = 'pending'
+                    ORDER BY id
+                    LIMIT ?
+                )
+                RETURNING id, filename, subject, sender, recipient, date_received, llm_model, llm_response
+            ''', (limit,))
+            rows = cursor.fetchall()
+            conn.commit()
+            return sorted(rows)
+
+    def reset_running_recheck(self, older_than=3600):
+        """Devolve à fila os rechecks interrompidos (running há mais de older_than segundos -> pending)
+
+        Os reservados há menos tempo podem estar em curso noutro processo.
+        """
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE email_analysis
+                SET recheck_status = 'pending'
+                WHERE recheck_status = 'running'
+                  AND (recheck_claimed_at IS NULL OR recheck_claimed_at <= ?)
+            ''', (format_timestamp(time.time() - older_than),))
+            conn.commit()
+            return cursor.rowcount
     
-    def update_recheck(self, filename, recheck_response, recheck_model):
+    def update_recheck(self, analysis_id, recheck_response, recheck_model, status='completed'):
         """Atualiza o resultado do recheck"""
-        # TODO: Implementar recheck com outro modelo LLM
-        # Este é o local onde deve ser implementado o recheck com outro modelo
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 UPDATE email_analysis 
-                SET recheck_status = 'completed',
+                SET recheck_status = ?,
                     recheck_response = ?,
                     recheck_model = ?,
                     recheck_at = CURRENT_TIMESTAMP
-                WHERE filename = ?
-            ''', (json.dumps(recheck_response), recheck_model, filename))
-            conn.commit()
\ No newline at end of file
+                WHERE id = ?
+            ''', (status, json.dumps(recheck_response), recheck_model, analysis_id))
+            conn.commit()
+
+    def retry_recheck(self, analysis_id, error, recheck_model, max_attempts=5):
+        """Devolve um recheck falhado à fila, ou passa-o a 'error' ao fim de max_attempts tentativas"""
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE email_analysis
+                SET recheck_attempts = recheck_attempts + 1,
+                    recheck_status = CASE WHEN recheck_attempts + 1 >= ? THEN 'error' ELSE 'pending' END,
+                    recheck_response = ?,
+                    recheck_model = ?,
+                    recheck_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+                RETURNING recheck_status
+            ''', (max_attempts, json.dumps(error), recheck_model, analysis_id))
+            row = cursor.fetchone()
+            conn.commit()
+        return row[0] if row else None
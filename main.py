@@ -1,15 +1,163 @@
 import dotenv
 import argparse
+import json
 import logging
 from pathlib import Path
-from email_main.email_processor import EmailProcessor
-from email_main.email_monitor import EmailMonitor
 import threading
+import os
+
+# The email_main pipeline modules (and bs4, requests, dkim, schedule behind them)
+# are imported inside the modes that use them, so the short-lived subcommands
+# start fast. Check with: python tools/check_importtime.py
+
+def start_alert_sender():
+    """Start the outbound alert queue when alerts are enabled"""
+    if os.getenv("SEND_EMAIL_ALERTS", "false").lower() != "true":
+        return None, None
+    from email_main.send_alerts import AlertSender
+    alert_sender = AlertSender()
+    alert_sender_thread = threading.Thread(target=alert_sender.start)
+    alert_sender_thread.start()
+    return alert_sender, alert_sender_thread
+
+def stop_alert_sender(alert_sender, alert_sender_thread):
+    """Send the queued alerts and stop the sender thread"""
+    if alert_sender:
+        alert_sender.stop()
+        alert_sender_thread.join(timeout=30)
+
+def run_search(args):
+    """Print the analyses matching a full-text query"""
+    from email_main.sqlmanager import SQLManager
+    query = '"' + args.query.replace('"', '""') + '"' if args.phrase else args.query
+    try:
+        results = SQLManager(db_path=args.db).search(query, limit=args.limit, order='recent' if args.recent else 'rank')
+    except (ValueError, RuntimeError) as e:
+        logging.error(e)
+        exit(1)
+
+    if args.json:
+        print(json.dumps(results, indent=4, ensure_ascii=False))
+        return
+    for result in results:
+        try:
+            verdict = json.loads(result['llm_response']).get('verdict')
+        except (TypeError, ValueError, AttributeError):
+            verdict = None
+        print(f"#{result['id']} {result['processed_at']} [{verdict}] {result['sender']} - {result['subject']}")
+        print(f"    {result['snippet']}")
+    print(f"{len(results)} result(s)")
+
+def run_archive(args):
+    """Import processed emails into the archive, read one back or print archive stats"""
+    from email_main.archive import EmailArchive
+    from email_main.sqlmanager import SQLManager
+    sql_manager = SQLManager(db_path=args.db)
+    archive = EmailArchive(sql_manager)
+    try:
+        if args.action == 'import':
+            folder = args.target or os.getenv("INBOX_PROCESSED_FOLDER")
+            if not folder:
+                logging.error("No folder given and INBOX_PROCESSED_FOLDER is not set")
+                exit(1)
+            print(f"{archive.import_folder(folder)} email(s) archived")
+        elif args.action == 'get':
+            if not args.target:
+                logging.error("Filename (or analysis id with --id) required")
+                exit(1)
+            raw_email = archive.get(analysis_id=int(args.target)) if args.id else archive.get(args.target)
+            if raw_email is None:
+                logging.error(f"{args.target} is not in the archive")
+                exit(1)
+            if args.output:
+                with open(args.output, 'wb') as f:
+                    f.write(raw_email)
+            else:
+                print(raw_email.decode('utf-8', errors='replace'))
+        else:
+            stats = sql_manager.get_archive_stats()
+            ratio = stats['raw_bytes'] / stats['stored_bytes'] if stats['stored_bytes'] else 0
+            print(f"{stats['count']} email(s), {stats['raw_bytes']} bytes stored as {stats['stored_bytes']} ({ratio:.1f}x)")
+    finally:
+        archive.close()
+
+def start_profiler(args, email_processor, email_monitor=None):
+    """Set up the profiler, idle until started by --profile or SIGUSR1"""
+    from email_main.profiling import Profiler
+    profiler = Profiler(output_folder=args.profile_output, window=args.profile_window)
+    profiler.watch(email_processor, 'process_single_email')
+    if email_monitor is not None:
+        profiler.watch(email_monitor, 'check_emails')
+    profiler.install_signal_handler()
+    if args.profile:
+        profiler.start()
+    return profiler
+
+def run_worker(args):
+    """Run a standalone EmailProcessor until interrupted"""
+    from email_main.email_processor import EmailProcessor
+    alert_sender, alert_sender_thread = start_alert_sender()
+    email_processor = EmailProcessor(alert_sender=alert_sender)
+    profiler = start_profiler(args, email_processor)
+    try:
+        email_processor.start()
+    except KeyboardInterrupt:
+        email_processor.stop()
+    stop_alert_sender(alert_sender, alert_sender_thread)
+    # Dump an open profiling window before exiting
+    profiler.stop()
+    logging.debug("Worker stopped.")
 
 def main():
     # Set up the argument parser
     parser = argparse.ArgumentParser(description="Email Processing Script")
     parser.add_argument('--verbose', action='store_true', help='Enable verbose logging (DEBUG level)')
+    parser.add_argument('--profile', action='store_true', help='Profile the processing loop from startup (toggle at runtime with SIGUSR1)')
+    parser.add_argument('--profile-window', type=int, help='Seconds each profiling window lasts (default: PROFILE_WINDOW or 300)')
+    parser.add_argument('--profile-output', help='Folder for pstats and allocation reports (default: PROFILE_OUTPUT_FOLDER or profiles)')
+    subparsers = parser.add_subparsers(dest='command')
+
+    # Offline replay benchmark (no IMAP, Ollama or Google API required)
+    replay_parser = subparsers.add_parser('replay', help='Replay a folder of .eml files through the processor and report throughput')
+    replay_parser.add_argument('corpus', help='Folder containing the .eml files to replay')
+    replay_parser.add_argument('--output', default='replay_results.json', help='JSON file for the results (default: replay_results.json)')
+    replay_parser.add_argument('--llm-latency-ms', type=float, default=500.0, help='Median latency of the fake LLM in milliseconds (default: 500)')
+    replay_parser.add_argument('--llm-latency-sigma', type=float, default=0.25, help='Log-normal sigma of the fake LLM latency (default: 0.25)')
+    replay_parser.add_argument('--phishing-ratio', type=float, default=0.1, help='Share of emails the fake LLM flags as phishing (default: 0.1)')
+    replay_parser.add_argument('--seed', type=int, default=42, help='Random seed for the fake LLM (default: 42)')
+    replay_parser.add_argument('--repeat', type=int, default=1, help='Number of times the corpus is replayed (default: 1)')
+
+    # Read-only dashboard API over the rollup tables
+    dashboard_parser = subparsers.add_parser('dashboard', help='Serve the read-only dashboard API')
+    dashboard_parser.add_argument('--db', default='email_analysis.db', help='SQLite database (default: email_analysis.db)')
+    dashboard_parser.add_argument('--host', help='Listen address (default: DASHBOARD_HOST or 127.0.0.1)')
+    dashboard_parser.add_argument('--port', type=int, help='Listen port (default: DASHBOARD_PORT or 8080)')
+
+    # Full-text search over analyzed emails
+    search_parser = subparsers.add_parser('search', help='Full-text search over analyzed emails (subject, sender, body, footer)')
+    search_parser.add_argument('query', help='FTS5 query, e.g. "reset password" or subject:invoice')
+    search_parser.add_argument('--phrase', action='store_true', help='Search the query as one exact phrase')
+    search_parser.add_argument('--recent', action='store_true', help='Newest matches first instead of best matches')
+    search_parser.add_argument('--limit', type=int, default=20, help='Maximum number of results (default: 20)')
+    search_parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    search_parser.add_argument('--db', default='email_analysis.db', help='SQLite database (default: email_analysis.db)')
+
+    # SQL dump of the analysis database
+    export_parser = subparsers.add_parser('export', help='Export the analysis database as an SQL file')
+    export_parser.add_argument('--output', default='email_analysis_export.sql', help='SQL file to write (default: email_analysis_export.sql)')
+    export_parser.add_argument('--db', default='email_analysis.db', help='SQLite database (default: email_analysis.db)')
+
+    # Compressed archive of processed emails
+    archive_parser = subparsers.add_parser('archive', help='Import processed .eml files into the archive, read one back or show stats')
+    archive_parser.add_argument('action', choices=['import', 'get', 'stats'], help='import a folder (default: INBOX_PROCESSED_FOLDER), get one email, or stats')
+    archive_parser.add_argument('target', nargs='?', help='Folder to import, or filename to get')
+    archive_parser.add_argument('--id', action='store_true', help='Treat the get target as an analysis id')
+    archive_parser.add_argument('--output', help='Write the email to this file instead of stdout')
+    archive_parser.add_argument('--db', default='email_analysis.db', help='SQLite database (default: email_analysis.db)')
+
+    # Extra processor process sharing the job queue (no IMAP monitor)
+    subparsers.add_parser('worker', help='Run only the email processor, sharing the job queue with other processes')
+
     args = parser.parse_args()
 
     # Set up logging based on the --verbose argument
@@ -26,9 +174,46 @@ def main():
     # Log to confirm the logging level
     logging.info(f"Logging level set to: {logging.getLevelName(logging.getLogger().level)}")
 
+    if args.command == 'replay':
+        from email_main.benchmark import run_replay
+        results = run_replay(
+            corpus_folder=args.corpus,
+            output_file=args.output,
+            latency_ms=args.llm_latency_ms,
+            sigma=args.llm_latency_sigma,
+            phishing_ratio=args.phishing_ratio,
+            seed=args.seed,
+            repeat=args.repeat
+        )
+        if results['failed']:
+            exit(1)
+        return
+
     # Path to .env file
     env_path = Path(".env")
 
+    if args.command == 'search':
+        run_search(args)
+        return
+
+    if args.command == 'export':
+        from email_main.sqlmanager import SQLManager
+        SQLManager(db_path=args.db).export_to_sql_file(args.output)
+        return
+
+    if args.command == 'dashboard':
+        from dashboard.api import serve
+        if env_path.is_file():
+            dotenv.load_dotenv(dotenv_path=env_path)
+        serve(db_path=args.db, host=args.host, port=args.port)
+        return
+
+    if args.command == 'archive':
+        if env_path.is_file():
+            dotenv.load_dotenv(dotenv_path=env_path)
+        run_archive(args)
+        return
+
     # Check if .env exists before loading
     if env_path.is_file():
         dotenv.load_dotenv(dotenv_path=env_path)
@@ -36,17 +221,37 @@ def main():
         logging.ERROR(".env file not found. Exiting")
         exit(1)
     
+    if args.command == 'worker':
+        run_worker(args)
+        return
+
+    from email_main.email_processor import EmailProcessor
+    from email_main.email_monitor import EmailMonitor
+
     # Instantiate EmailProcessor and EmailMonitor
-    email_processor = EmailProcessor()
-    email_monitor = EmailMonitor()
+    alert_sender, alert_sender_thread = start_alert_sender()
+    email_processor = EmailProcessor(alert_sender=alert_sender)
+    email_monitor = EmailMonitor(flow=email_processor.flow)
+
+    # Optional second-opinion engine with its own thread budget
+    recheck_engine = None
+    if os.getenv("RECHECK_ENABLED", "false").lower() == "true":
+        from email_main.recheck import RecheckEngine
+        recheck_engine = RecheckEngine(email_processor)
+
+    profiler = start_profiler(args, email_processor, email_monitor)
     
     # Start threads
     email_monitor_thread = threading.Thread(target=email_monitor.start_schedule)
     email_processor_thread = threading.Thread(target=email_processor.start)
     
+    recheck_thread = threading.Thread(target=recheck_engine.start, daemon=True) if recheck_engine else None
+    
     try:
         email_processor_thread.start()
         email_monitor_thread.start()
+        if recheck_thread:
+            recheck_thread.start()
         
         # Wait for threads to finish
         email_processor_thread.join()
@@ -56,10 +261,17 @@ def main():
         logging.debug("Received interrupt signal. Stopping...")
         email_processor.stop()
         email_monitor.stop()
+        if recheck_engine:
+            recheck_engine.stop()
         
         # Wait for threads to finish gracefully
         email_processor_thread.join(timeout=5)
         email_monitor_thread.join(timeout=5)
+
+    stop_alert_sender(alert_sender, alert_sender_thread)
+
+    # Dump an open profiling window before exiting
+    profiler.stop()
         
     logging.debug("Application stopped.")
 
@@ -0,0 +1,77 @@
+"""Import-time regression check for the entry point
+
+Runs ``python -X importtime -c "import <module>"`` for each module and fails
+when one of the heavy dependencies is loaded at import time. They must only be
+imported by the code paths that use them. Modules the interpreter already loads
+at startup (``-c pass``, e.g. from site-packages .pth files) are not counted.
+
+    python tools/check_importtime.py [--budget-ms 200] [--top 10] [module ...]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Top-level packages that must not be loaded by a plain import
+FORBIDDEN = {'bs4', 'soupsieve', 'requests', 'urllib3', 'charset_normalizer', 'certifi',
+             'dkim', 'nacl', 'cryptography', 'schedule'}
+
+DEFAULT_MODULES = ['main', 'email_main.email_processor', 'email_main.email_monitor', 'email_main.recheck']
+
+
+def import_times(module):
+    """(package, self_us, cumulative_us) for every module loaded by importing module"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}' if module else 'pass'],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times.append((name.strip(), int(self_us), int(cumulative_us)))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that heavy dependencies are not loaded at import time")
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES, help='Modules to import (default: entry point and pipeline modules)')
+    parser.add_argument('--budget-ms', type=float, help='Also fail when a module takes longer than this to import')
+    parser.add_argument('--top', type=int, default=5, help='Number of slowest imports to show (default: 5)')
+    args = parser.parse_args()
+
+    startup = {name for name, _, _ in import_times(None)}
+
+    failed = False
+    for module in args.modules:
+        try:
+            times = [t for t in import_times(module) if t[0] not in startup]
+        except RuntimeError as e:
+            print(f"FAIL {e}")
+            failed = True
+            continue
+
+        total_ms = next((c for name, _, c in times if name == module), 0) / 1000
+        loaded = sorted({name.split('.')[0] for name, _, _ in times} & FORBIDDEN)
+        over_budget = args.budget_ms is not None and total_ms > args.budget_ms
+        status = 'FAIL' if loaded or over_budget else 'ok'
+        print(f"{status:4} import {module}: {total_ms:.1f} ms, {len(times)} modules")
+        if loaded:
+            print(f"     heavy dependencies loaded: {', '.join(loaded)}")
+        if over_budget:
+            print(f"     over the {args.budget_ms:g} ms budget")
+        for name, self_us, _ in sorted(times, key=lambda t: t[1], reverse=True)[:args.top]:
+            print(f"     {self_us / 1000:7.1f} ms  {name}")
+        failed = failed or status == 'FAIL'
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()